@@ -0,0 +1,139 @@
+"""Benchmarks for auto_class.analyze
+
+Usage: python benchmarks/bench_analyze.py [benchmark name ...]
+Runs every benchmark if no names are given"""
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from copy import deepcopy
+from time import perf_counter
+
+from auto_class import analyze
+from auto_class.frontends.json import infer_json
+
+
+def make_records(n: int, seed: int = 0) -> list:
+    """A realistic-ish stream of API records: mostly homogeneous, with a few optional and rarely-seen keys"""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        record = {
+            'id': i,
+            'name': f'record-{i}',
+            'status': rnd.choice(['active', 'disabled', 'pending']),
+            'created': f'2020-01-{rnd.randint(1, 28):02d}T00:00:00Z',
+            'score': rnd.random(),
+            'tags': [rnd.choice('abcdef') for _ in range(rnd.randint(0, 4))],
+            'owner': {'id': rnd.randint(1, 100), 'email': f'user{i}@example.com', 'admin': rnd.random() < 0.1},
+            'address': {'street': '1 Main St', 'city': 'Toronto', 'postal_code': 'M5S 1A1'},
+        }
+        if rnd.random() < 0.3:
+            record['description'] = None
+        if rnd.random() < 0.01:
+            record['owner']['groups'] = [{'id': 1, 'name': 'admins'}]
+        records.append(record)
+    return records
+
+
+def timed(fn, *args, **kwargs):
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def bench_parallel():
+    """infer() vs infer_parallel() with an increasing number of worker processes"""
+    records = make_records(200_000)
+    baseline, _ = timed(analyze.infer, records)
+    print(f"infer():                   {baseline:.2f}s")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        elapsed, _ = timed(analyze.infer_parallel, records, workers=workers, chunk_size=5000)
+        print(f"infer_parallel(workers={workers:<2}): {elapsed:.2f}s  speedup: {baseline / elapsed:.2f}x")
+        workers *= 2
+
+
+def bench_fused():
+    """convert_hash_tables() -> reduce() -> annotate() vs the fused single-pass analyze()"""
+    records = make_records(50_000)
+
+    def three_pass(t):
+        return analyze.annotate(analyze.reduce(analyze.convert_hash_tables(t, {}), {}), {})
+
+    # the three-pass analysis modifies its input, so callers which need to keep their data have to copy it first
+    copy, data = timed(deepcopy, records)
+    three, _ = timed(three_pass, data)
+    fused, _ = timed(analyze.analyze, records)
+    print(f"deepcopy:     {copy:.2f}s")
+    print(f"three passes: {three:.2f}s")
+    print(f"analyze():    {fused:.2f}s  speedup: {three / fused:.2f}x ({(copy + three) / fused:.2f}x including copy)")
+
+    depth = 10_000
+    nested = 'bottom'
+    for _ in range(depth):
+        nested = {'child': [nested]}
+    elapsed, _ = timed(analyze.analyze, nested)
+    print(f"analyze() on {depth}-deep data: {elapsed:.3f}s")
+    try:
+        three_pass(nested)
+    except RecursionError:
+        print(f"three passes on {depth}-deep data: RecursionError")
+
+
+def bench_shapes():
+    """infer() on a homogeneous record stream, with and without record shape interning"""
+    records = make_records(100_000)
+    plain, _ = timed(analyze.infer, records, {'max_shapes': 0})
+    interned, rs = timed(analyze.infer, records)
+    print(f"without shape interning: {plain:.2f}s")
+    print(f"with shape interning:    {interned:.2f}s  speedup: {plain / interned:.2f}x")
+    for path, shapes in analyze.shape_frequencies(rs).items():
+        print(f"  {path or '<root>'}: {len(shapes)} shapes, most common seen {next(iter(shapes.values()))} times")
+
+
+def bench_json_stream():
+    """peak memory of json.load() + analyze() vs the event-driven infer_json() on growing JSON documents"""
+    for n in (10_000, 40_000):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(make_records(n), f)
+        try:
+            for label, fn in (('json.load + analyze', lambda fp: analyze.analyze(json.load(fp))),
+                              ('infer_json', infer_json)):
+                with open(f.name) as fp:
+                    tracemalloc.start()
+                    elapsed, _ = timed(fn, fp)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                print(f"{n} records, {label:<20} {elapsed:.2f}s  peak memory: {peak / 2 ** 20:.1f} MiB")
+        finally:
+            os.unlink(f.name)
+
+
+def bench_formats():
+    """the cost of string format detection, per string, on a stream with datetime, enum-like and free-text strings"""
+    records = make_records(200_000)
+    strings = sum(1 for r in records for v in r.values() if isinstance(v, str)) + len(records)  # owner emails
+    plain, _ = timed(analyze.infer, records)
+    checked, rs = timed(analyze.infer, records, {'formats': analyze.BUILTIN_FORMATS})
+    print(f"without format detection: {plain:.2f}s")
+    print(f"with format detection:    {checked:.2f}s  ({(checked - plain) / strings * 1e9:.0f}ns per string)")
+    print(f"  created: {rs.fields['created'].formats}")
+
+
+BENCHMARKS = {
+    'parallel': bench_parallel,
+    'fused': bench_fused,
+    'shapes': bench_shapes,
+    'json_stream': bench_json_stream,
+    'formats': bench_formats,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"--- {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
@@ -0,0 +1,353 @@
+"""Benchmarks for auto_class.backends.py_dataclass
+
+Usage: python benchmarks/bench_py_dataclass.py [benchmark name ...]
+Runs every benchmark if no names are given"""
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from copy import deepcopy
+from io import StringIO
+from time import perf_counter
+
+from auto_class import analyze
+from auto_class import intermediate_representation as ir
+from auto_class.backends import py_dataclass as pd
+
+
+SCALARS = ['str', 'int', 'float', 'bool']
+
+
+def make_ir(n_classes: int, seed: int = 0) -> ir.ResultSet:
+    """A large manifest like the ones generated from big API payloads: `n_classes` nested classes, each with a
+    handful of scalar, list, optional and hash table members, and a few sub-shapes (address, audit_info) which are
+    repeated all over the place"""
+    rnd = random.Random(seed)
+
+    def address():
+        return ir.DataClass('Address', [ir.Member('street', [ir.Type('str')]), ir.Member('city', [ir.Type('str')]),
+                                        ir.Member('postal code', [ir.Type('str'), ir.Type('None')], optional=True)])
+
+    def audit_info():
+        return ir.DataClass('AuditInfo', [ir.Member('created', [ir.Type('str')]),
+                                          ir.Member('created_by', [ir.Type('int')]),
+                                          ir.Member('tags', [ir.Sequence('list', [ir.Type('str')])])])
+
+    def members(n):
+        result = []
+        for i in range(n):
+            kind = rnd.random()
+            if kind < 0.5:
+                types = [ir.Type(rnd.choice(SCALARS))]
+            elif kind < 0.7:
+                types = [ir.Type(rnd.choice(SCALARS)), ir.Type('None')]
+            elif kind < 0.85:
+                types = [ir.Sequence('list', [ir.Type(rnd.choice(SCALARS))])]
+            else:
+                types = [ir.HashTable(key=ir.Type('str'), values=[ir.Type(rnd.choice(SCALARS))])]
+            result.append(ir.Member(f'field-{i}', types, optional=rnd.random() < 0.2))
+        result.append(ir.Member('address', [address()]))
+        result.append(ir.Member('audit_info', [audit_info()]))
+        return result
+
+    # every third class gets a nested class of its own, the rest are top-level members of the root class
+    classes = []
+    for i in range(n_classes):
+        dc = ir.DataClass(f'Class{i}', members(rnd.randint(5, 15)))
+        if classes and i % 3 == 0:
+            classes[-1].members.append(ir.Member(f'child {i}', [dc]))
+        else:
+            classes.append(dc)
+    root = ir.DataClass('Root', [ir.Member(dc.name.lower(), [dc]) for dc in classes])
+    return ir.ResultSet([root])
+
+
+def timed(fn, *args, **kwargs):
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+class NoRenderCache(pd.RenderCache):
+    def render(self, what, node, render, context):
+        return render(node, context)
+
+
+def bench_render_cache():
+    """rendering a 3,000 class manifest with and without the render cache"""
+    rs = make_ir(3000)
+
+    def uncached():
+        context = pd.GenerationContext()
+        context.cache = NoRenderCache()
+        return [pd.render_definition(dc, context) for dc in rs.dataclasses]
+
+    def cached():
+        context = pd.GenerationContext()
+        return [pd.render_definition(dc, context) for dc in rs.dataclasses]
+
+    plain, expected = timed(uncached)
+    fast, result = timed(cached)
+    assert result == expected
+    print(f"without render cache: {plain:.2f}s")
+    print(f"with render cache:    {fast:.2f}s  speedup: {plain / fast:.2f}x")
+    elapsed, _ = timed(pd.generate_dataclass_definitions, rs)
+    print(f"generate_dataclass_definitions(): {elapsed:.2f}s")
+
+
+def bench_nesting():
+    """generation time and output size for increasingly deeply nested classes. Time should grow with output size"""
+    for depth in (50, 100, 200):
+        dc = ir.DataClass('Leaf', [ir.Member('value', [ir.Type('int')])])
+        for i in range(depth):
+            dc = ir.DataClass(f'Level{i}', [ir.Member('child', [dc]), ir.Member('name', [ir.Type('str')])])
+        elapsed, output = timed(pd.generate_dataclass_definitions, ir.ResultSet([dc]))
+        print(f"depth {depth:<4} {elapsed * 1000:.1f}ms  {len(output) / 2 ** 10:.0f} KiB  "
+              f"{elapsed * 1e9 / len(output):.0f}ns per character")
+
+
+def bench_no_clone():
+    """time and peak memory of writing a 3,000 class manifest, compared to what it takes just to copy the IR (which
+    is what converting the IR into backend objects used to do before rendering)"""
+    rs = make_ir(3000)
+    for label, fn in (('copy of the IR', lambda: deepcopy(rs)),
+                      ('write_dataclass_definitions', lambda: pd.write_dataclass_definitions(rs, StringIO()))):
+        tracemalloc.start()
+        elapsed, _ = timed(fn)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<28} {elapsed:.2f}s  peak memory: {peak / 2 ** 20:.1f} MiB")
+
+
+def bench_hoist():
+    """size and import time of a generated module, with nested classes defined in place vs hoisted and deduplicated"""
+    rs = make_ir(600)
+    for label, options in (('nested', {}), ('hoisted', {'hoist': True})):
+        source = pd.generate_dataclass_definitions(rs, options=options)
+        elapsed, _ = timed(exec, compile(source, '<generated>', 'exec'), {})
+        print(f"{label:<8} {source.count(chr(10)):>6} lines  {source.count('@dataclass'):>5} classes  "
+              f"import: {elapsed:.2f}s")
+
+
+def bench_slots():
+    """memory per loaded instance of a generated class, with and without the `slots` option"""
+    address = ir.DataClass('Address', [ir.Member('street', [ir.Type('str')]), ir.Member('city', [ir.Type('str')])])
+    person = ir.DataClass('Person', [ir.Member('name', [ir.Type('str')]), ir.Member('age', [ir.Type('int')]),
+                                     ir.Member('email', [ir.Type('str'), ir.Type('None')], optional=True),
+                                     ir.Member('address', [address])])
+    records = [dict(name=f'person {i}', age=i, email=None, address=dict(street=f'{i} main st', city='Toronto'))
+               for i in range(10000)]
+    for label, options in (('plain', {}), ('slots', {'slots': True})):
+        module = {}
+        exec(pd.generate_dataclass_definitions(ir.ResultSet([person]), options=options), module)
+        schema = module['Person'].Schema(many=True)
+        tracemalloc.start()
+        loaded = schema.load(records)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # each record loads into two instances, a Person and its Address. the strings are shared with `records`
+        print(f"{label:<6} {size / (2 * len(loaded)):.0f} bytes per instance")
+
+
+def make_orders(n: int, seed: int = 0):
+    """A realistic nested payload (orders with addresses, line items, and totals) and the IR which describes it"""
+    rnd = random.Random(seed)
+
+    def address():
+        return ir.DataClass('Address', [ir.Member('street', [ir.Type('str')]), ir.Member('city', [ir.Type('str')]),
+                                        ir.Member('postal code', [ir.Type('str'), ir.Type('None')], optional=True)])
+
+    item = ir.DataClass('Items', [ir.Member('sku', [ir.Type('str')]), ir.Member('quantity', [ir.Type('int')]),
+                                  ir.Member('price', [ir.Type('float')]),
+                                  ir.Member('tags', [ir.Sequence('list', [ir.Type('str')])], optional=True)])
+    order = ir.DataClass('Order', [
+        ir.Member('id', [ir.Type('int')]), ir.Member('created-at', [ir.Type('datetime')]),
+        ir.Member('status', [ir.Type('str')], default='new'), ir.Member('note', [ir.Type('str'), ir.Type('None')]),
+        ir.Member('shipping', [address()]), ir.Member('billing', [address(), ir.Type('None')], optional=True),
+        ir.Member('items', [ir.Sequence('list', [item])]),
+        ir.Member('totals', [ir.HashTable(key=ir.Type('str'), values=[ir.Type('float')])]),
+    ])
+    records = []
+    for i in range(n):
+        record = {
+            'id': i, 'created-at': f'2020-01-{i % 28 + 1:02}T12:00:00+00:00',
+            'note': rnd.choice([None, 'leave at door']),
+            'shipping': {'street': f'{i} main st', 'city': 'Toronto', 'postal code': 'M5V 2T6'},
+            'items': [{'sku': f'sku-{rnd.randint(0, 999)}', 'quantity': rnd.randint(1, 5), 'price': rnd.random() * 100,
+                       'tags': ['sale'] * rnd.randint(0, 2)} for _ in range(rnd.randint(1, 5))],
+            'totals': {'subtotal': 1.0, 'tax': 0.13, 'shipping': 5.0},
+        }
+        if rnd.random() < 0.5:
+            record['billing'] = {'street': f'{i} bay st', 'city': 'Toronto'}
+        records.append(record)
+    return ir.ResultSet([order]), records
+
+
+def bench_fast_io():
+    """loading and dumping 10,000 nested records with the generated `from_dict()`/`to_dict()` vs the marshmallow
+    Schema"""
+    rs, records = make_orders(10000)
+    module = {}
+    exec(pd.generate_dataclass_definitions(rs, options={'fast_io': True}), module)
+    cls = module['Order']
+    schema = cls.Schema(many=True)
+
+    plain, expected = timed(schema.load, records)
+    fast, loaded = timed(lambda: [cls.from_dict(r) for r in records])
+    assert loaded == expected
+    print(f"Schema().load: {plain:.2f}s")
+    print(f"from_dict():   {fast:.2f}s  speedup: {plain / fast:.1f}x")
+
+    plain, expected = timed(schema.dump, loaded)
+    fast, dumped = timed(lambda: [o.to_dict() for o in loaded])
+    assert dumped == expected
+    print(f"Schema().dump: {plain:.2f}s")
+    print(f"to_dict():     {fast:.2f}s  speedup: {plain / fast:.1f}x")
+
+
+def bench_lazy_schema():
+    """import time of a module with 3,000 classes with every Schema built up front (like marshmallow_dataclass did
+    before 8.0), with marshmallow_dataclass's own `dataclass`, and with the `lazy_schema` option"""
+    rs = make_ir(3000)
+
+    def eager(module):
+        for value in list(module.values()):
+            if hasattr(value, '__dataclass_fields__'):
+                value.Schema
+
+    for label, options, after in (('eager', {}, eager), ('marshmallow_dataclass', {}, None),
+                                  ('lazy_schema', {'lazy_schema': True}, None)):
+        code = compile(pd.generate_dataclass_definitions(rs, options=dict(options, hoist=True)), '<generated>', 'exec')
+        module = {}
+        elapsed, _ = timed(exec, code, module)
+        if after:
+            elapsed += timed(after, module)[0]
+        first, _ = timed(getattr, module['Address'], 'Schema')
+        print(f"{label:<22} import: {elapsed:.2f}s  first Address.Schema: {first * 1000:.1f}ms")
+
+
+def bench_batch_io():
+    """throughput of loading 10,000 nested records one at a time with a new Schema for each, and in batches"""
+    rs, records = make_orders(10000)
+    for options in ({'batch_io': True}, {'batch_io': True, 'fast_io': True}):
+        module = {}
+        exec(pd.generate_dataclass_definitions(rs, options=options), module)
+        cls = module['Order']
+        results = [
+            ('Schema().load() per record', timed(lambda: [cls.Schema().load(r) for r in records])[0]),
+            ('load_many()', timed(cls.load_many, records)[0]),
+            ('iter_load()', timed(lambda: sum(1 for _ in cls.iter_load(iter(records))))[0]),
+        ]
+        print(f"with options {options}:")
+        for label, elapsed in results:
+            print(f"  {label:<28} {len(records) / elapsed:>9,.0f} records/s")
+
+
+def bench_lazy_nested():
+    """load time and memory for 2,000 wide records (100 nested objects each) when only 3 fields are read, loaded
+    eagerly and with the `lazy_nested` option"""
+    rnd = random.Random(0)
+    child = ir.DataClass('Child', [ir.Member('name', [ir.Type('str')]), ir.Member('value', [ir.Type('int')]),
+                                   ir.Member('tags', [ir.Sequence('list', [ir.Type('str')])])])
+    members = [ir.Member('id', [ir.Type('int')]), ir.Member('name', [ir.Type('str')]),
+               ir.Member('status', [ir.Type('str')]),
+               ir.Member('children', [ir.Sequence('list', [child])]),
+               ir.Member('labels', [ir.HashTable(key=ir.Type('str'), values=[ir.Type('str')])])]
+    members += [ir.Member(f'section {i}', [child]) for i in range(50)]
+    rs = ir.ResultSet([ir.DataClass('Wide', members)])
+
+    def make_child():
+        return {'name': f'child {rnd.randint(0, 999)}', 'value': rnd.randint(0, 999), 'tags': ['a', 'b']}
+
+    records = []
+    for i in range(2000):
+        record = {'id': i, 'name': f'record {i}', 'status': 'ok', 'children': [make_child() for _ in range(49)],
+                  'labels': {f'label {j}': 'x' for j in range(10)}}
+        record.update((f'section {j}', make_child()) for j in range(50))
+        records.append(record)
+
+    for label, options in (('eager', {'fast_io': True}), ('lazy_nested', {'lazy_nested': True})):
+        module = {}
+        exec(pd.generate_dataclass_definitions(rs, options=dict(options, hoist=True)), module)
+        from_dict = module['Wide'].from_dict
+
+        def load_and_read():
+            loaded = [from_dict(r) for r in records]
+            return loaded, [(o.id, o.name, o.status) for o in loaded]
+
+        elapsed, _ = timed(load_and_read)
+        tracemalloc.start()
+        loaded, _ = load_and_read()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label:<12} load and read 3 fields: {elapsed * 1000:.0f}ms  memory: {size / 2 ** 20:.1f} MiB")
+
+
+def bench_literals():
+    """memory held by 100,000 records loaded from json with 3 low-cardinality string fields, once the json has been
+    let go of, with plain `str` fields and with the `Literal` fields inferred with the `max_distinct` option"""
+    rnd = random.Random(0)
+    statuses, regions = ['pending', 'processing', 'shipped', 'delivered'], ['us-east-1', 'eu-west-1', 'ap-south-1']
+    text = json.dumps([{'id': i, 'status': rnd.choice(statuses), 'region': rnd.choice(regions),
+                        'kind': rnd.choice(['standard order', 'express order'])} for i in range(100000)])
+    for label, options in (('str', {}), ('Literal', {'max_distinct': 16})):
+        rs = ir.ResultSet([analyze.to_ir(analyze.infer(json.loads(text), options), 'Order')])
+        module = {}
+        exec(pd.generate_dataclass_definitions(rs, options={'fast_io': True, 'hoist': True}), module)
+        from_dict = module['Order'].from_dict
+
+        def load():
+            return [from_dict(r) for r in json.loads(text)]
+
+        elapsed, _ = timed(load)
+        tracemalloc.start()
+        loaded = load()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label:<8} load: {elapsed * 1000:.0f}ms  memory: {size / 2 ** 20:.1f} MiB")
+
+
+def bench_package():
+    """time to import one class from 3,000 classes generated into a single module, and into a package (from
+    source, without bytecode caches)"""
+    rs = make_ir(3000)
+    sys.dont_write_bytecode = True
+    with tempfile.TemporaryDirectory() as path:
+        with open(os.path.join(path, 'bench_module.py'), 'w') as f:
+            pd.write_dataclass_definitions(rs, f, options={'hoist': True})
+        pd.write_dataclass_package(rs, os.path.join(path, 'bench_package'))
+        sys.path.insert(0, path)
+        try:
+            for label, module, name in (('module', 'bench_module', 'Address'), ('package', 'bench_package', 'Address'),
+                                        ('package', 'bench_package', 'Class1')):
+                elapsed, _ = timed(lambda: getattr(importlib.import_module(module), name))
+                loaded = len([m for m in sys.modules if m.startswith(module)])
+                print(f"{label:<8} import {name:<8}: {elapsed * 1000:.0f}ms  modules: {loaded}")
+        finally:
+            sys.path.remove(path)
+            sys.dont_write_bytecode = False
+
+
+BENCHMARKS = {
+    'render_cache': bench_render_cache,
+    'nesting': bench_nesting,
+    'no_clone': bench_no_clone,
+    'hoist': bench_hoist,
+    'slots': bench_slots,
+    'fast_io': bench_fast_io,
+    'lazy_schema': bench_lazy_schema,
+    'batch_io': bench_batch_io,
+    'lazy_nested': bench_lazy_nested,
+    'literals': bench_literals,
+    'package': bench_package,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"--- {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
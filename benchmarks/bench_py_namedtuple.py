@@ -0,0 +1,40 @@
+"""Benchmarks for auto_class.backends.py_namedtuple
+
+Usage: python benchmarks/bench_py_namedtuple.py [benchmark name ...]
+Runs every benchmark if no names are given"""
+import sys
+import tracemalloc
+
+from auto_class.backends import generate
+from bench_py_dataclass import make_orders, timed
+
+
+def bench_records():
+    """memory and load time for 10,000 nested records as NamedTuples vs data classes (all loaded with their generated
+    `from_dict()`). The memory includes the tuples and read-only mappings NamedTuples copy each loaded list and hash
+    table into (data classes keep the lists and dicts they're loaded from)"""
+    rs, records = make_orders(10000)
+    for label, backend, options in (('py_dataclass', 'py_dataclass', {'fast_io': True}),
+                                    ('py_dataclass, slots', 'py_dataclass', {'fast_io': True, 'slots': True}),
+                                    ('py_namedtuple', 'py_namedtuple', {})):
+        module = {}
+        exec(generate(rs, backend, options), module)
+        from_dict = module['Order'].from_dict
+        elapsed, _ = timed(lambda: [from_dict(r) for r in records])
+        tracemalloc.start()
+        loaded = [from_dict(r) for r in records]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label:<20} load: {elapsed:.3f}s  memory: {size / 2 ** 20:.1f} MiB")
+
+
+BENCHMARKS = {
+    'records': bench_records,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"--- {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
@@ -1,92 +1,406 @@
-from typing import List, Dict, Any, Union
-from uuid import UUID
+from typing import List, Dict, Any, Union, Iterable, Iterator, Optional, Callable, Tuple, Set
 from os.path import commonprefix
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime
+from itertools import islice, repeat
+import os
+import random
 import re
 
+from auto_class import intermediate_representation as ir
 
-class HashTable(list):
-    keys: list
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SAMPLE_SIZE = 5
+
+
+class HashTable:
+    """A lightweight view of a dict which has been identified as a hash table. Iterating over it gives the dict's
+    values, and `keys` gives the dict's keys. Nothing is copied"""
+    __slots__ = ('source',)
 
     def __init__(self, d: dict):
-        self.keys = list(d)
-        super().__init__(list(d.values()))
+        self.source = d
+
+    @property
+    def keys(self):
+        return self.source.keys()
+
+    def __iter__(self):
+        return iter(self.source.values())
+
+    def __len__(self):
+        return len(self.source)
+
+    def __repr__(self):
+        return f"HashTable({self.source!r})"
+
+
+class ResultSet:
+    """A compact summary of every value observed at a single position in the analyzed data (ie every value of the
+    `owner` key of every record in a list of records).
+
+    Instead of keeping the values themselves, a ResultSet keeps:
+        counts: the number of non-null values seen of each type (by type name, ie {'str': 10, 'int': 2})
+        nulls: the number of `None` values seen
+        present: the number of values seen (including `None`s)
+        missing: the number of times the dict this ResultSet belongs to was seen without this key
+        samples: a small, bounded reservoir of example values for each scalar type. It holds the SAMPLE_SIZE smallest
+            distinct values of each type, which keeps it independent of the order in which values were seen
+        formats: the names of the string formats (see `register_format()`) which every string seen here matched
+        distinct: the distinct strings seen here, if there were no more than the `max_distinct` option of them (0, the
+            default, turns this off). Fields with only a few distinct strings become `Literal`s (see `to_ir()`)
+
+    Nested values are summarized by nested ResultSets:
+        fields: one ResultSet per key of every (non hash table) dict seen here
+        items: a single ResultSet for every element of every list seen here
+        keys / values: a single ResultSet each for every key and every value of every hash table seen here
+        shapes: the distinct sets of keys of the dicts seen here, and how often each was seen (see `Shape`)
+
+    `types`, `type` and `optional` are filled in by `annotate()`
+    """
+    __slots__ = ('counts', 'nulls', 'present', 'missing', 'samples', 'formats', 'column', 'distinct', 'fields', 'items',
+                 'keys', 'values', 'shapes', 'types', 'type', 'optional')
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.nulls = 0
+        self.present = 0
+        self.missing = 0
+        self.samples: Dict[str, list] = {}
+        self.formats: tuple = None
+        self.column: List[str] = None  # strings waiting to be checked against `formats`
+        # the distinct strings seen here, until there are more than the `max_distinct` option of them (then False)
+        self.distinct: Set[str] = None
+        self.fields: Dict[Any, 'ResultSet'] = None
+        self.items: 'ResultSet' = None
+        self.keys: 'ResultSet' = None
+        self.values: 'ResultSet' = None
+        self.shapes: Dict[tuple, Shape] = None
+        self.types: set = None
+        self.type: Any = None
+        self.optional: bool = False
+
+    def add_sample(self, type_name: str, value: Any):
+        samples = self.samples.get(type_name)
+        if samples is None:
+            self.samples[type_name] = [value]
+            return
+        try:
+            if len(samples) >= SAMPLE_SIZE and not value < samples[-1]:
+                # The common case once the reservoir is full. No allocation needed
+                return
+            i = bisect_left(samples, value)
+        except TypeError:
+            # values of this type can't be ordered, we'll have to make do with the samples we've already got
+            return
+        if i == len(samples) or samples[i] != value:
+            samples.insert(i, value)
+            del samples[SAMPLE_SIZE:]
+
+    def __eq__(self, other):
+        if not isinstance(other, ResultSet):
+            return NotImplemented
+        # nested ResultSets are compared with an explicit stack, so there's no limit on how deeply they can be nested
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if not all(getattr(a, slot) == getattr(b, slot) for slot in _FLAT_SLOTS):
+                return False
+            if (a.fields is None) != (b.fields is None):
+                return False
+            if a.fields is not None:
+                if a.fields.keys() != b.fields.keys():
+                    return False
+                stack.extend((field, b.fields[k]) for k, field in a.fields.items())
+            for slot in ('items', 'keys', 'values'):
+                a_nested, b_nested = getattr(a, slot), getattr(b, slot)
+                if (a_nested is None) != (b_nested is None):
+                    return False
+                if a_nested is not None:
+                    stack.append((a_nested, b_nested))
+        return True
+
+    def __repr__(self):
+        return f"ResultSet(counts={self.counts}, nulls={self.nulls}, present={self.present}, " \
+               f"missing={self.missing}, fields={list(self.fields) if self.fields is not None else None})"
+
+
+# the slots of a ResultSet which don't hold nested ResultSets
+_FLAT_SLOTS = tuple(slot for slot in ResultSet.__slots__ if slot not in ('fields', 'items', 'keys', 'values'))
+
+
+class Shape:
+    """An interned record shape: a set of keys (in order) seen together in dicts at one position in the data.
+
+    A Shape holds the ResultSets of its keys in the same order as the keys, and the ResultSets of the keys it doesn't
+    have, so a dict with a shape we've seen before can be folded by walking its values positionally, without looking
+    up any of its keys"""
+    __slots__ = ('keys', 'fields', 'absent', 'known', 'count')
+
+    def __init__(self, keys: tuple, fields: list):
+        self.keys = keys
+        self.fields = fields
+        self.absent: list = []
+        self.known = -1  # the number of fields `absent` was worked out against
+        self.count = 0
+
+    def update_absent(self, fields: Dict[Any, ResultSet]):
+        if self.known != len(fields):
+            keys = set(self.keys)
+            self.absent = [field for k, field in fields.items() if k not in keys]
+            self.known = len(fields)
 
+    def __eq__(self, other):
+        if not isinstance(other, Shape):
+            return NotImplemented
+        return (self.keys, self.count) == (other.keys, other.count)
 
-class ResultSet(list):
-    types: set = None
-    type: Any = None
-    optional: bool = False
+    def __repr__(self):
+        return f"Shape(keys={self.keys}, count={self.count})"
 
 
 _td_re = re.compile(r'(\d+)$')
+_uuid_re = re.compile(r'(?:urn:uuid:)?{?[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}}?\Z', re.I)
+
+KEY_SAMPLE_SIZE = 16
+MAX_SHAPES = 256
+
+HASHTABLE_DETECTORS: Dict[str, Callable[[Iterable], bool]] = {}
+
+DEFAULT_DETECTORS = ('numbers', 'common_prefix', 'uuids', 'numeric_suffix')
+
+FORMAT_BATCH_SIZE = 1024
+
+STRING_FORMATS: Dict[str, Tuple[str, Callable[[List[str]], bool]]] = {}
+
+# The formats this module registers. When the strings at a position match more than one format, the first one listed
+# wins. None are checked by default, since they change what the generated classes dump: numeric string IDs (which APIs
+# often send as strings so javascript clients don't lose precision) would be dumped as numbers, and timestamps the way
+# `isoformat()` writes them. Pass these (or some of them) as the `formats` option to check them
+BUILTIN_FORMATS = ('datetime', 'date', 'uuid', 'int')
+DEFAULT_FORMATS = ()
+
+# A string field becomes a `Literal` of the values seen in it when there are no more than `max_distinct` of them, and
+# each one was seen at least this many times on average
+MIN_REPEATS = 2
+
+# only the timestamps `datetime.fromisoformat()` can parse in python 3.7 - 3.10 (which is how `from_dict()` loads them):
+# 3 or 6 digit fractions and offsets with a colon, like `datetime.isoformat()` writes them. Others (ie `+0000` or `.1`)
+# stay strings, which loads them the same way on every version
+_datetime_re = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{3}(?:\d{3})?)?)?(?:Z|[+-]\d{2}:\d{2})?\Z')
+_date_re = re.compile(r'\d{4}-\d{2}-\d{2}\Z')
+# only the way python writes ints: no signs or leading zeros, which would be lost on the way through `int()` (like the
+# ones in zip codes and phone numbers)
+_int_re = re.compile(r'(?:0|[1-9][0-9]*)\Z')
 
 
 def get_opts(options: Dict = None) -> Dict:
     if options is None:
         options = dict()
-    default_options = dict(threshold=10)
+    default_options = dict(threshold=10, detectors=DEFAULT_DETECTORS, key_sample=KEY_SAMPLE_SIZE,
+                           max_shapes=MAX_SHAPES, formats=DEFAULT_FORMATS, max_distinct=0, sample_size=None,
+                           per_shape=None, patience=None, seed=0)
     default_options.update(options)
     options = default_options
     return options
 
 
+def register_detector(name: str, check: Callable[[Iterable], bool] = None):
+    """Registers a hash table detector under `name`. Can also be used as a decorator.
+
+    A detector is a function which takes an iterable of dict keys and returns True if they look like the keys of a
+    hash table. Detectors should return False as soon as they come across a key that doesn't fit.
+
+    Registered detectors are only used when they're named in the `detectors` option, so adding detectors for unusual
+    key shapes doesn't slow down analysis of data which doesn't need them. Ex:
+
+        @register_detector('mac_addresses')
+        def all_keys_are_mac_addresses(keys):
+            return all(isinstance(k, str) and MAC_RE.match(k) for k in keys)
+
+        analyze(data, {'detectors': DEFAULT_DETECTORS + ('mac_addresses',)})
+    """
+    def register(fn: Callable[[Iterable], bool]):
+        HASHTABLE_DETECTORS[name] = fn
+        return fn
+
+    if check is None:
+        return register
+    return register(check)
+
+
+@register_detector('common_prefix')
 def all_keys_have_common_prefix(d) -> bool:
-    prefix = commonprefix(list(d.keys()))
-    if len(prefix) > 0:
-        return True
-    return False
+    prefix = None
+    for k in d:
+        if not isinstance(k, str):
+            return False
+        if prefix is None:
+            prefix = k
+        elif not k.startswith(prefix):
+            prefix = commonprefix([prefix, k])
+            if not prefix:
+                return False
+    return bool(prefix)
 
 
+@register_detector('numeric_suffix')
 def all_keys_are_have_numbers(d) -> bool:
     """`has_common_prefix() catches most instances of this, but sometimes hash tables have sets of keys like:
     {'00', '01', '02', ...}. This function identifies those"""
-    for k in d.keys():
-        m = _td_re.search(k)
-        if not m:
+    for k in d:
+        if not isinstance(k, str) or not _td_re.search(k):
             # This key does not end in a number, therefore not all keys end in numbers
             return False
     return True
 
+
+@register_detector('numbers')
 def all_keys_are_numbers(d) -> bool:
-    return all([isinstance(k, int) for k in d])
+    return all(isinstance(k, int) for k in d)
+
 
+@register_detector('uuids')
 def all_keys_are_uuids(d) -> bool:
+    """Accepts the usual string forms of a UUID (with or without hyphens, braces or a `urn:uuid:` prefix). This uses a
+    regex instead of calling `uuid.UUID()` and catching exceptions for every key"""
+    return all(isinstance(k, str) and _uuid_re.match(k) for k in d)
+
+
+def get_detectors(names: Iterable[Union[str, Callable]] = None) -> List[Callable[[Iterable], bool]]:
+    """Looks up hash table detectors by name. Detector functions can be passed in directly too"""
+    if names is None:
+        names = DEFAULT_DETECTORS
+    return [HASHTABLE_DETECTORS[n] if isinstance(n, str) else n for n in names]
+
+
+def register_format(name: str, check: Callable[[List[str]], bool] = None, type_name: str = None):
+    """Registers a string format under `name`. Can also be used as a decorator.
+
+    A format check is a function which takes a list of strings (a batch of up to FORMAT_BATCH_SIZE strings seen at
+    the same position in the data) and returns True if every one of them is in this format. Checks should return False
+    as soon as they come across a string that doesn't match. Once a format has failed at a position, it's never
+    checked there again, so data without any formatted strings costs next to nothing to check.
+
+    Strings at a position where every string matched a format get the IR type `type_name` (which defaults to `name`)
+    instead of `str`. Only the formats named in the `formats` option are checked. Ex:
+
+        @register_format('email')
+        def all_strings_are_emails(column):
+            return all(map(EMAIL_RE.fullmatch, column))
+
+        analyze(data, {'formats': ('email',) + BUILTIN_FORMATS})
+    """
+    def register(fn: Callable[[List[str]], bool]):
+        STRING_FORMATS[name] = (type_name or name, fn)
+        return fn
+
+    if check is None:
+        return register
+    return register(check)
+
+
+def _all_parse(parse: Callable[[str], Any], column: List[str]) -> bool:
+    """whether `parse` accepts every string in `column`. The regexes only check the shape of a date, so this is what
+    keeps strings like `2019-02-30` (or serial numbers like `1234-56-78`) from being taken for dates, which the
+    generated classes couldn't load"""
     try:
-        for k in d:
-            UUID(k)
+        for s in column:
+            parse(s)
     except ValueError:
         return False
-    else:
-        return True
+    return True
+
+
+def _parse_datetime(s: str) -> datetime:
+    # the way `from_dict()` loads datetimes (see `py_dataclass.SCALAR_LOADERS`)
+    return datetime.fromisoformat(s.replace('Z', '+00:00'))
+
+
+@register_format('datetime')
+def all_strings_are_datetimes(column: List[str]) -> bool:
+    """ISO 8601 timestamps in the forms `datetime.isoformat()` writes (or with a `Z` offset), like
+    `2019-01-31T12:00:00.123+00:00`, of dates and times which exist"""
+    return all(map(_datetime_re.match, column)) and _all_parse(_parse_datetime, column)
+
+
+@register_format('date')
+def all_strings_are_dates(column: List[str]) -> bool:
+    return all(map(_date_re.match, column)) and _all_parse(date.fromisoformat, column)
+
+
+@register_format('uuid', type_name='UUID')
+def all_strings_are_uuids(column: List[str]) -> bool:
+    return all(map(_uuid_re.match, column))
+
+
+@register_format('int')
+def all_strings_are_ints(column: List[str]) -> bool:
+    """Strings holding unsigned whole numbers without leading zeros, like `'42'` (but not `'02134'` or `'+1555'`).
+    Uses NumPy's vectorized string operations if it's installed"""
+    if numpy is None:
+        return all(map(_int_re.match, column))
+    column = numpy.array(column, dtype=str)
+    lengths = numpy.char.str_len(column)
+    # ascii digits only, since `isdecimal()` takes digits from other scripts too
+    non_digits = numpy.char.str_len(numpy.char.lstrip(column, '0123456789'))
+    leading_zeros = numpy.char.startswith(column, '0') & (lengths > 1)
+    return bool(numpy.all((lengths > 0) & (non_digits == 0) & ~leading_zeros))
+
+
+def _check_formats(node: ResultSet):
+    column = node.column
+    node.formats = tuple(f for f in node.formats if STRING_FORMATS[f][1](column))
+    del column[:]
+
+
+def _flush_formats(pending: List[ResultSet]):
+    """checks whatever strings are left waiting in the columns of `pending` ResultSets"""
+    for node in pending:
+        if node.column:
+            _check_formats(node)
+        node.column = None
+    del pending[:]
 
 
-def is_hashtable(d: dict, threshold=10):
+def is_hashtable(d: dict, threshold=10, detectors: Iterable[Union[str, Callable]] = None,
+                 sample_size=KEY_SAMPLE_SIZE):
     """makes an educated guess about whether or not this given dictionary is a hash table
     (a keyed list where all the values are the same type).
 
-    It does this by identifying if one of the following conditions are true:
-        All keys have a common prefix (ex. keys like 'group-1737', 'group-8572', 'group-0439')
-        All keys have numeric suffixes
+    It does this by identifying if one of the following conditions (detectors) are true:
         All keys are actually numbers
+        All keys have a common prefix (ex. keys like 'group-1737', 'group-8572', 'group-0439')
         All keys are UUIDs
+        All keys have numeric suffixes
+    Or any other detectors named in `detectors` (see `register_detector()`).
     It only identifies dicts as hash tables if one of these conditions has been met, and the size of the dict exceeds
-    the threshold"""
+    the threshold.
 
-    if len(d.keys()) < threshold:
+    Each detector is first tried on a sample of the first `sample_size` keys, and gives up on the first key that
+    doesn't fit. Only a detector which fits the whole sample gets checked against the rest of the keys, so most dicts
+    which aren't hash tables are rejected after looking at a handful of keys"""
+
+    if len(d) < threshold:
         # dictionary size below threshold, not considered a hashtable
         return False
 
-    if all_keys_are_numbers(d):
-        return True
+    checks = get_detectors(detectors)
+    if len(d) <= sample_size:
+        return any(check(d) for check in checks)
 
-    if all_keys_have_common_prefix(d):
-        return True
-
-    if all_keys_are_uuids(d):
-        return True
-
-    if all_keys_are_have_numbers(d):
-        return True
+    sample = list(islice(d, sample_size))
+    for check in checks:
+        if check(sample) and check(d):
+            return True
 
     return False
 
@@ -99,20 +413,17 @@ def convert_hash_tables(t: Any, options: Dict) -> Any:
             t[i] = convert_hash_tables(v, options)
 
     if isinstance(t, dict):
-        if is_hashtable(t, options['threshold']):
-            table = HashTable(t)
-            return convert_hash_tables(table, options)
-
-        else:
-            for k, v in t.items():
-                t[k] = convert_hash_tables(v, options)
+        for k, v in t.items():
+            t[k] = convert_hash_tables(v, options)
+        if is_hashtable(t, options['threshold'], options['detectors'], options['key_sample']):
+            return HashTable(t)
 
     return t
 
 
 def reduce(t: Any, options: Dict) -> Any:
     """recursively applies itself to a nested data structure. if given a list of dicts, will reduce those down to a
-    list of a single dict, whose values are ResultSets of the values from the dicts in the original list
+    list of a single dict, whose values are ResultSets summarizing the values from the dicts in the original list
 
      Example:
         [
@@ -130,8 +441,8 @@ def reduce(t: Any, options: Dict) -> Any:
         ]
         Becomes:
         {
-            'hello': ResultSet([1, 'one', 3]),
-            'world': ResultSet(['two', None])
+            'hello': ResultSet(counts={'int': 2, 'str': 1}, nulls=0, present=3, missing=0),
+            'world': ResultSet(counts={'str': 1}, nulls=1, present=2, missing=1)
 
     :param t: the input data to operate on
     :param options: a dictionary of options to be passed around where needed
@@ -143,31 +454,54 @@ def reduce(t: Any, options: Dict) -> Any:
         # Handle the 'list-of-dicts' case
         dicts = [v for v in t if isinstance(v, dict)]
         remainder = [v for v in t if not isinstance(v, dict)]
-        reduced_dict: Dict[Any, ResultSet] = {}
         if dicts:
+            reduced = ResultSet()
+            pending = []
             for d in dicts:
-                for k in d:
-                    # This is inefficient, i know, but it covers the case where keys only exist in some of the dicts in
-                    # the list
-                    reduced_dict.setdefault(k, ResultSet()).append(d[k])
+                # `convert_hash_tables()` has already dealt with any of these dicts which are hash tables
+                _fold(reduced, d, options, as_record=True, pending=pending)
+            _flush_formats(pending)
 
             # Now we want to replace original dicts in the list with the reduced dict. We need to do the replacement in
-            # place so that we can preserve custom list subclasses like HashTable
+            # place so that we can preserve custom list subclasses
             t.clear()
             t.extend(remainder)
-            t.append(reduced_dict)
+            t.append(reduced.fields)
 
         # recurse into all lists, regardless of what's in them
         for i, v in enumerate(t):
             t[i] = reduce(v, options)
 
-    if isinstance(t, dict):
-        for k, v in t.items():
-            t[k] = reduce(v, options)
+    if isinstance(t, (dict, HashTable)):
+        d = t.source if isinstance(t, HashTable) else t
+        for k, v in d.items():
+            d[k] = reduce(v, options)
 
     return t
 
 
+def _annotate_result_set(rs: ResultSet):
+    # Schemas can be nested just as deeply as the data they describe, so we walk them with an explicit stack
+    stack = [rs]
+    while stack:
+        rs = stack.pop()
+        rs.types = set(rs.counts)
+        rs.optional = rs.nulls > 0
+
+        if len(rs.types) > 1:
+            rs.type = 'Union'
+        elif len(rs.types) < 1:
+            rs.type = 'Any'
+        else:
+            rs.type = next(iter(rs.types))
+
+        for nested in (rs.items, rs.keys, rs.values):
+            if nested is not None:
+                stack.append(nested)
+        if rs.fields is not None:
+            stack.extend(rs.fields.values())
+
+
 def annotate(t: Any, options: Dict) -> Any:
     options = get_opts(options)
 
@@ -180,21 +514,576 @@ def annotate(t: Any, options: Dict) -> Any:
             t[k] = annotate(v, options)
 
     if isinstance(t, ResultSet):
-        t.types = {type(v).__name__ for v in t}
-        if 'NoneType' in t.types:
-            t.optional = True
-            t.types.remove('NoneType')
-
-        if len(t.types) > 1:
-            t.type = 'Union'
-        elif len(t.types) < 1:
-            t.type = 'Any'
-        else:
-            t.type = next(iter(t.types))
+        _annotate_result_set(t)
 
     return t
 
 
+def _visit_record(rs: ResultSet, d: dict, max_shapes: int) -> Iterator:
+    fields = rs.fields
+    if fields is None:
+        fields = rs.fields = {}
+        rs.shapes = {}
+    dicts = rs.counts.get('dict', 0)
+    # The fingerprint of a dict's shape is the tuple of its keys. Its hash is cheap to compute, since all the key
+    # strings have already cached their hashes
+    keys = tuple(d)
+    shape = rs.shapes.get(keys)
+    if shape is None:
+        children = []
+        for k in keys:
+            field = fields.get(k)
+            if field is None:
+                # This key has been missing from every dict we've seen here until now
+                field = fields[k] = ResultSet()
+                field.missing = dicts
+            children.append(field)
+        shape = Shape(keys, children)
+        if len(rs.shapes) < max_shapes:
+            rs.shapes[keys] = shape
+    shape.update_absent(fields)
+    shape.count += 1
+    for field in shape.absent:
+        field.missing += 1
+    rs.counts['dict'] = dicts + 1
+    return zip(shape.fields, d.values())
+
+
+def _fold(rs: ResultSet, value: Any, options: Dict, as_record: bool = False, pending: List[ResultSet] = None
+          ) -> ResultSet:
+    """The single-pass core of the analyzer. Folds `value` into `rs`, detecting hash tables, merging dicts and summarizing
+    values in one visit per node.
+    Nodes are visited in the same order a recursive walk would visit them, but with an explicit stack of iterators
+    over (ResultSet, value) pairs, so there's no limit on how deeply `value` can be nested.
+    `value` is only ever read. Nothing in it is modified or copied
+
+    Strings are collected into per-position columns and checked against the `formats` option a batch at a time.
+    Callers folding many values should pass the same `pending` list to every call and `_flush_formats()` it at the
+    end, so that batches can fill up across values. Without it, columns are checked before returning"""
+    threshold, detectors, sample_size = options['threshold'], get_detectors(options['detectors']), options['key_sample']
+    max_shapes, formats, max_distinct = options['max_shapes'], tuple(options['formats']), options['max_distinct']
+    flush = pending is None
+    if flush:
+        pending = []
+    if as_record:
+        # `value` is a dict which has already been checked, and is not a hash table
+        rs.present += 1
+        stack = [_visit_record(rs, value, max_shapes)]
+    else:
+        stack = [iter(((rs, value),))]
+
+    while stack:
+        for node, value in stack[-1]:
+            node.present += 1
+            if value is None:
+                node.nulls += 1
+                continue
+
+            if isinstance(value, dict) and not is_hashtable(value, threshold, detectors, sample_size):
+                stack.append(_visit_record(node, value, max_shapes))
+                break
+
+            if isinstance(value, (dict, HashTable)):
+                if node.keys is None:
+                    node.keys = ResultSet()
+                    node.values = ResultSet()
+                node.counts['HashTable'] = node.counts.get('HashTable', 0) + 1
+                if isinstance(value, HashTable):
+                    value = value.source
+                stack.append(zip(repeat(node.values), value.values()))
+                stack.append(zip(repeat(node.keys), value.keys()))
+                break
+
+            if isinstance(value, list):
+                if node.items is None:
+                    node.items = ResultSet()
+                node.counts['list'] = node.counts.get('list', 0) + 1
+                stack.append(zip(repeat(node.items), value))
+                break
+
+            type_name = type(value).__name__
+            node.add_sample(type_name, value)
+            node.counts[type_name] = node.counts.get(type_name, 0) + 1
+            if type_name == 'str' and formats:
+                if node.formats is None:
+                    node.formats = formats
+                if node.formats:
+                    if node.column is None:
+                        node.column = []
+                        pending.append(node)
+                    node.column.append(value)
+                    if len(node.column) >= FORMAT_BATCH_SIZE:
+                        _check_formats(node)
+            if type_name == 'str' and max_distinct:
+                distinct = node.distinct
+                if distinct is None:
+                    distinct = node.distinct = set()
+                if distinct is not False and value not in distinct:
+                    if len(distinct) < max_distinct:
+                        distinct.add(value)
+                    else:
+                        node.distinct = False
+        else:
+            # This iterator is exhausted, go back to its parent
+            stack.pop()
+
+    if flush:
+        _flush_formats(pending)
+    return rs
+
+
+def fold(rs: ResultSet, value: Any, options: Dict = None) -> ResultSet:
+    """folds a single value (usually one record from a stream of records) into `rs`, a running inferred structure.
+
+    Values are summarized rather than stored (see `ResultSet`), and every dict folded into `rs` is merged into
+    `rs.fields`, every list into `rs.items`, and so on all the way down. The size of `rs` therefore depends only on
+    the shape of the data, not on how many records were folded into it.
+
+    :param rs: the running inferred structure. start with an empty ResultSet
+    :param value: the value to fold into `rs`
+    :param options: a dictionary of options to be passed around where needed
+    :return: `rs`, updated in place
+    """
+    return _fold(rs, value, get_opts(options))
+
+
+def fold_list(rs: ResultSet, items: Iterable, options: Dict = None) -> ResultSet:
+    """Same as `fold(rs, list(items))`, but consumes `items` one at a time, so the list never has to exist in memory"""
+    options = get_opts(options)
+    rs.present += 1
+    rs.counts['list'] = rs.counts.get('list', 0) + 1
+    if rs.items is None:
+        rs.items = ResultSet()
+    pending = []
+    for item in items:
+        _fold(rs.items, item, options, pending=pending)
+    _flush_formats(pending)
+    return rs
+
+
+def fold_hashtable(rs: ResultSet, pairs: Iterable[Tuple[Any, Any]], options: Dict = None) -> ResultSet:
+    """Same as `fold(rs, HashTable(dict(pairs)))`, but consumes `pairs` (key, value tuples) one at a time, so the hash
+    table never has to exist in memory"""
+    options = get_opts(options)
+    rs.present += 1
+    rs.counts['HashTable'] = rs.counts.get('HashTable', 0) + 1
+    if rs.keys is None:
+        rs.keys = ResultSet()
+        rs.values = ResultSet()
+    pending = []
+    for k, v in pairs:
+        _fold(rs.keys, k, options, pending=pending)
+        _fold(rs.values, v, options, pending=pending)
+    _flush_formats(pending)
+    return rs
+
+
+def infer(records: Iterable, options: Dict = None, result: ResultSet = None) -> ResultSet:
+    """infers the structure of a stream of records (any iterable, including generators, NDJSON files, etc).
+
+    Records are consumed one at a time and folded into a running inferred structure with `fold()`, so memory use is
+    proportional to the size of the inferred schema instead of the number of records.
+    The result's `fields` are equivalent to the reduced dict from `reduce(convert_hash_tables(list(records)))`, and
+    the result can be passed to `annotate()`
+
+    :param records: an iterable of records (usually dicts)
+    :param options: a dictionary of options to be passed around where needed
+    :param result: the result of a previous call to `infer()` (ex. loaded from a checkpoint) to fold `records` into.
+        Folding more records into a previous result gives the same result as inferring all of them in one go
+    :return: a ResultSet summarizing the records
+    """
+    options = get_opts(options)
+    rs = ResultSet() if result is None else result
+    pending = []
+    for record in sample_records(records, options):
+        _fold(rs, record, options, pending=pending)
+    _flush_formats(pending)
+    return rs
+
+
+SAMPLING_OPTIONS = ('sample_size', 'per_shape', 'patience')
+
+
+def _signatures(value: Any, options: Dict) -> set:
+    """Returns the set of (path, kind) pairs found in `value`, where `kind` is the set of keys of a dict (its shape) or
+    the type name of any other value. Two records with the same signatures would add nothing new to each other's
+    inferred structure"""
+    threshold, detectors, sample_size = options['threshold'], get_detectors(options['detectors']), options['key_sample']
+    found = set()
+    stack = [((), value)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict) and not is_hashtable(value, threshold, detectors, sample_size):
+            found.add((path, tuple(value)))
+            stack.extend((path + (k,), v) for k, v in value.items())
+        elif isinstance(value, dict):
+            found.add((path, 'HashTable'))
+            stack.extend((path + ('{keys}',), k) for k in value.keys())
+            stack.extend((path + ('{}',), v) for v in value.values())
+        elif isinstance(value, list):
+            found.add((path, 'list'))
+            stack.extend((path + ('[]',), v) for v in value)
+        else:
+            found.add((path, type(value).__name__))
+    return found
+
+
+def sample_records(records: Iterable, options: Dict = None) -> Iterator:
+    """Picks the records to infer a structure from, according to the sampling options. With none of them set, every
+    record is returned as is.
+
+    - `sample_size`: keep a uniform random sample of this many records (reservoir sampling, seeded with the `seed`
+      option so that the same input always gives the same sample). Only `sample_size` records are kept in memory
+    - `per_shape`: always keep the first `per_shape` records having each distinct shape or type at each path, so that
+      rare nested shapes still get seen even when they're unlikely to make it into the random sample
+    - `patience`: stop reading `records` once this many records in a row have had no new fields or types in them
+
+    Use `coverage()` on the resulting ResultSet to see how many observations each inferred type is based on
+
+    :param records: an iterable of records (usually dicts)
+    :param options: a dictionary of options to be passed around where needed
+    :return: an iterator over the selected records
+    """
+    options = get_opts(options)
+    size, per_shape, patience = options['sample_size'], options['per_shape'], options['patience']
+    if size is None and per_shape is None and patience is None:
+        yield from records
+        return
+
+    rand = random.Random(options['seed'])
+    reservoir = []
+    strata: Dict[tuple, int] = {}
+    seen = set()
+    quiet = 0
+    for i, record in enumerate(records):
+        signatures = _signatures(record, options) if per_shape or patience else ()
+        if patience:
+            if signatures <= seen:
+                quiet += 1
+            else:
+                seen |= signatures
+                quiet = 0
+        if per_shape and any(strata.get(s, 0) < per_shape for s in signatures):
+            for s in signatures:
+                strata[s] = strata.get(s, 0) + 1
+            yield record
+        elif size is None:
+            yield record
+        elif len(reservoir) < size:
+            reservoir.append(record)
+        else:
+            j = rand.randint(0, i)
+            if j < size:
+                reservoir[j] = record
+        if patience and quiet >= patience:
+            break
+    yield from reservoir
+
+
+def coverage(rs: ResultSet) -> Dict[str, Dict[str, Any]]:
+    """Reports, for each position in `rs` (see `walk()` for the path format), how much evidence its inferred type is
+    based on: the number of values `seen` there (`nulls` of which were None), the number of parent records it was
+    `missing` from, the `ratio` of parent records which had it, and how many values of each type were seen"""
+    report = {}
+    for path, node in walk(rs):
+        total = node.present + node.missing
+        report[path] = dict(seen=node.present, nulls=node.nulls, missing=node.missing,
+                            ratio=node.present / total if total else 0.0, types=dict(node.counts))
+    return report
+
+
+def analyze(t: Any, options: Dict = None) -> ResultSet:
+    """Analyzes a data structure of any size and depth in a single pass, and returns an annotated ResultSet summarizing
+    it. This does the work of `convert_hash_tables()`, `reduce()` and `annotate()` in one non-recursive walk over the
+    data (visiting each node exactly once), and never modifies `t`.
+
+    Example:
+        analyze([{'hello': 1}, {'hello': 'one', 'world': None}])
+        Returns:
+        ResultSet(counts={'list': 1}, items=ResultSet(counts={'dict': 2}, fields={
+            'hello': ResultSet(counts={'int': 1, 'str': 1}, type='Union'),
+            'world': ResultSet(counts={}, nulls=1, missing=1, type='Any', optional=True)
+        }))
+
+    :param t: the input data to operate on
+    :param options: a dictionary of options to be passed around where needed
+    :return: a ResultSet describing `t`
+    """
+    rs = _fold(ResultSet(), t, get_opts(options))
+    _annotate_result_set(rs)
+    return rs
+
+
+def walk(rs: ResultSet) -> Iterator:
+    """Yields a (path, ResultSet) pair for `rs` and every ResultSet nested inside it, without recursion.
+    Paths look like `owner.groups[].name`, where `[]` stands for the items of a list and `{}` for the values of a hash
+    table (`{keys}` for its keys)"""
+    stack = [('', rs)]
+    while stack:
+        path, rs = stack.pop()
+        yield path, rs
+        children = []
+        if rs.fields is not None:
+            children.extend((f"{path}.{k}" if path else str(k), field) for k, field in rs.fields.items())
+        for suffix, nested in (('[]', rs.items), ('{keys}', rs.keys), ('{}', rs.values)):
+            if nested is not None:
+                children.append((path + suffix, nested))
+        stack.extend(reversed(children))
+
+
+def shape_frequencies(rs: ResultSet) -> Dict[str, Dict[tuple, int]]:
+    """Returns, for each position in `rs` where dicts were seen, how many dicts of each distinct shape (set of keys)
+    were seen there, most common shape first. Useful for figuring out how homogeneous a data set really is"""
+    return {
+        path: dict(sorted(((keys, shape.count) for keys, shape in node.shapes.items()), key=lambda i: -i[1]))
+        for path, node in walk(rs) if node.shapes
+    }
+
+
+def _merge_samples(a: Dict[str, list], b: Dict[str, list]) -> Dict[str, list]:
+    samples = {k: list(v) for k, v in a.items()}
+    for type_name, values in b.items():
+        merged = samples.setdefault(type_name, [])
+        merged.extend(v for v in values if v not in merged)
+        try:
+            merged.sort()
+        except TypeError:
+            pass
+        del merged[SAMPLE_SIZE:]
+    return samples
+
+
+def _merge_distinct(a: Optional[set], b: Optional[set], max_distinct: Optional[int]) -> Optional[set]:
+    if a is False or b is False:
+        return False
+    if a is None or b is None:
+        return None if a is None and b is None else set(a if b is None else b)
+    distinct = a | b
+    if max_distinct is not None and len(distinct) > max_distinct:
+        return False
+    return distinct
+
+
+def merge(a: Optional[ResultSet], b: Optional[ResultSet], max_distinct: int = None) -> Optional[ResultSet]:
+    """combines two ResultSets (usually the results of inferring the structure of two halves of a data set) into a new
+    ResultSet, as if every value folded into `b` had been folded into `a`. Neither input is modified.
+
+    All statistics are merged with associative and commutative operations (sums, unions and the smallest distinct
+    samples), so the result doesn't depend on how the data was split up. The only thing that depends on the order of
+    the arguments is the order of `counts` and `fields` (a's keys come first), which is what decides the order of
+    members and types in generated classes. `PartialSchema.merge()` takes care of putting the arguments in order.
+
+    :param max_distinct: the `max_distinct` option the inputs were built with. Without it, distinct strings are
+        merged without a limit
+    """
+    if a is None or b is None:
+        return a if b is None else b
+
+    merged = ResultSet()
+    # (a, b, result) triples still to be merged. Nested ResultSets are merged with an explicit stack, so there's no
+    # limit on how deeply they can be nested
+    stack = [(a, b, merged)]
+    while stack:
+        a, b, result = stack.pop()
+        result.counts = dict(a.counts)
+        for type_name, count in b.counts.items():
+            result.counts[type_name] = result.counts.get(type_name, 0) + count
+        result.nulls = a.nulls + b.nulls
+        result.present = a.present + b.present
+        # added to, since the dict this ResultSet belongs to may already have counted some missing keys
+        result.missing += a.missing + b.missing
+        result.samples = _merge_samples(a.samples, b.samples)
+        if a.formats is None or b.formats is None:
+            result.formats = a.formats if b.formats is None else b.formats
+        else:
+            result.formats = tuple(f for f in a.formats if f in b.formats)
+        result.distinct = _merge_distinct(a.distinct, b.distinct, max_distinct)
+        for slot in ('items', 'keys', 'values'):
+            a_nested, b_nested = getattr(a, slot), getattr(b, slot)
+            if a_nested is None or b_nested is None:
+                setattr(result, slot, a_nested if b_nested is None else b_nested)
+            else:
+                nested = ResultSet()
+                setattr(result, slot, nested)
+                stack.append((a_nested, b_nested, nested))
+
+        if a.fields is not None or b.fields is not None:
+            a_fields, b_fields = a.fields or {}, b.fields or {}
+            result.fields = {}
+            for k in {**a_fields, **b_fields}:
+                field = result.fields[k] = ResultSet()
+                stack.append((a_fields.get(k) or ResultSet(), b_fields.get(k) or ResultSet(), field))
+                if k not in b_fields:
+                    # every dict in `b` was missing this key
+                    field.missing += b.counts.get('dict', 0)
+                elif k not in a_fields:
+                    field.missing += a.counts.get('dict', 0)
+
+            result.shapes = {}
+            for shapes in (a.shapes or {}, b.shapes or {}):
+                for keys, shape in shapes.items():
+                    merged_shape = result.shapes.get(keys)
+                    if merged_shape is None:
+                        merged_shape = result.shapes[keys] = Shape(keys, [result.fields[k] for k in keys])
+                    merged_shape.count += shape.count
+
+    return merged
+
+
+class PartialSchema:
+    """The inferred structure of a contiguous chunk of records (`records[start:stop]`).
+
+    Partial schemas of adjacent chunks of the same stream can be combined in either order and any grouping with
+    `merge()`, and will always produce the same result as inferring the structure of the whole stream in one go"""
+    __slots__ = ('start', 'stop', 'result')
+
+    def __init__(self, start: int, stop: int, result: ResultSet):
+        self.start = start
+        self.stop = stop
+        self.result = result
+
+    def merge(self, other: 'PartialSchema', max_distinct: int = None) -> 'PartialSchema':
+        first, second = sorted([self, other], key=lambda p: p.start)
+        return PartialSchema(first.start, max(self.stop, other.stop), merge(first.result, second.result, max_distinct))
+
+
+def _infer_chunk(start: int, chunk: list, options: Dict) -> PartialSchema:
+    return PartialSchema(start, start + len(chunk), infer(chunk, options))
+
+
+def infer_parallel(records: Iterable, options: Dict = None, workers: int = None,
+                   chunk_size: int = 10000) -> ResultSet:
+    """Same as `infer()`, but splits `records` into chunks of `chunk_size` records and infers the structure of each
+    chunk in a separate process, merging the partial schemas as they come back.
+
+    Records must be picklable. Only `workers * 2` chunks are in flight or waiting to be merged at any one time (a slow
+    chunk holds up the chunks after it), so `records` can still be a lazy stream which doesn't fit in memory
+
+    :param records: an iterable of records (usually dicts)
+    :param options: a dictionary of options to be passed around where needed
+    :param workers: the number of worker processes to use. defaults to the number of CPUs on the machine
+    :param chunk_size: the number of records to send to a worker at a time
+    :return: a ResultSet summarizing the records
+    """
+    options = get_opts(options)
+    # Records are sampled here, as they're read, rather than separately in each chunk
+    records = sample_records(records, options)
+    options = dict(options, **{name: None for name in SAMPLING_OPTIONS})
+    combined = PartialSchema(0, 0, ResultSet())
+    finished: Dict[int, PartialSchema] = {}
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        start = 0
+        while True:
+            # chunks which finished ahead of a slower one count too, since they're held until they can be merged
+            while len(pending) + len(finished) < max_pending:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                pending.add(pool.submit(_infer_chunk, start, chunk, options))
+                start += len(chunk)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                partial = future.result()
+                finished[partial.start] = partial
+            # Chunks can finish in any order, but we only merge adjacent chunks so that the order of fields and types
+            # always matches the order of the input
+            while combined.stop in finished:
+                combined = combined.merge(finished.pop(combined.stop), options['max_distinct'])
+    return combined.result
+
+
+def _class_name(name: Any) -> str:
+    """`sub_class` becomes `SubClass`, `a-class list` becomes `AClassList`, etc"""
+    return ''.join([s[:1].upper() + s[1:] for s in re.split(r'[\s_\-]+', str(name)) if s])
+
+
+def _ir_members(fields: dict, stack: list) -> List[ir.Member]:
+    """Creates a member for each field, and pushes the work of filling in its types onto `stack` (see `_build_ir()`)"""
+    members = []
+    for k, v in fields.items():
+        if not isinstance(v, ResultSet):
+            # `reduce()` leaves the values of dicts which aren't in lists alone
+            v = fold(ResultSet(), v)
+        types = []
+        stack.append((v, k, types))
+        members.append(ir.Member(name=str(k), types=types, optional=v.missing > 0))
+    return members
+
+
+def _build_ir(stack: list):
+    """Works through a stack of (ResultSet, name, types) tasks, filling in each `types` list with the IR types of its
+    ResultSet. Nested types are created with empty lists, which are pushed onto the stack to be filled in later, so
+    there's no limit on how deeply the ResultSets can be nested"""
+    untyped = []  # the types of lists and hash table values, which become `Any` if nothing was seen in them
+    while stack:
+        rs, name, types = stack.pop()
+        for type_name in rs.counts:
+            if type_name == 'dict':
+                types.append(ir.DataClass(name=_class_name(name), members=_ir_members(rs.fields, stack)))
+            elif type_name == 'list':
+                items = []
+                stack.append((rs.items, name, items))
+                untyped.append(items)
+                types.append(ir.Sequence('list', types=items))
+            elif type_name == 'HashTable':
+                key_types = set(rs.keys.counts)
+                key = ir.Type(key_types.pop() if len(key_types) == 1 else 'str')
+                values = []
+                stack.append((rs.values, name, values))
+                untyped.append(values)
+                types.append(ir.HashTable(key=key, values=values))
+            elif type_name == 'str' and rs.formats:
+                # every string seen here is in the same format. Use the first matching format's type instead of `str`
+                refined = ir.Type(STRING_FORMATS[rs.formats[0]][0])
+                if refined not in types:
+                    types.append(refined)
+            elif type_name == 'str' and rs.distinct and rs.counts['str'] >= MIN_REPEATS * len(rs.distinct):
+                # only a few distinct strings, seen over and over. Probably an enum
+                types.append(ir.Literal('str', values=sorted(rs.distinct)))
+            elif ir.Type(type_name) not in types:
+                types.append(ir.Type(type_name))
+        if rs.nulls:
+            types.append(ir.Type('None'))
+    for types in untyped:
+        if not types:
+            types.append(ir.Type('Any'))
+
+
+def _ir_types(rs: ResultSet, name: str) -> List[ir.Type]:
+    types = []
+    _build_ir([(rs, name, types)])
+    return types
+
+
+def _ir_dataclass(fields: dict, name: str) -> ir.DataClass:
+    stack = []
+    dc = ir.DataClass(name=_class_name(name), members=_ir_members(fields, stack))
+    _build_ir(stack)
+    return dc
+
+
+def to_ir(t: Any, name: str) -> ir.DataClass:
+    """converts the output of `infer()` or `reduce()` (or `annotate()`) into an intermediate representation
+    DataClass called `name`, ready to be handed to a backend.
+    Keys which were missing from some of the analyzed dicts become optional (`AllowMissing`) members
+
+    :param t: a ResultSet, a reduced dict, or a list whose dicts have been reduced into a single dict
+    :param name: the name of the top-level data class
+    """
+    if isinstance(t, ResultSet):
+        # `analyze()`ing a list of records gives us a ResultSet whose items are the records
+        while t.fields is None and t.items is not None:
+            t = t.items
+        t = t.fields
+    elif isinstance(t, list):
+        t = next((v for v in t if isinstance(v, dict)), None)
+    return _ir_dataclass(t or {}, name)
+
 
 # def idontknow(output_dict, options):
 #         # now we've got our output_dict populated, we need to recurse into every value that is itself a list of dicts
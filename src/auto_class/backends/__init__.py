@@ -0,0 +1,21 @@
+from auto_class import intermediate_representation as ir
+from auto_class.backends import py_dataclass, py_namedtuple
+
+from typing import Callable, Dict
+
+
+# Every backend renders a ResultSet into the source code of a python module
+BACKENDS: Dict[str, Callable[..., str]] = {
+    'py_dataclass': py_dataclass.generate_dataclass_definitions,
+    'py_namedtuple': py_namedtuple.generate_namedtuple_definitions,
+}
+
+
+def generate(rs: ir.ResultSet, backend: str = 'py_dataclass', options: Dict = None) -> str:
+    """Renders `rs` into the source code of a python module with one of the `BACKENDS`
+
+    :param options: options for the backend (see the backend's `get_opts()`)
+    """
+    if backend not in BACKENDS:
+        raise Exception(f'Unknown backend {backend}. Available backends: {", ".join(BACKENDS)}')
+    return BACKENDS[backend](rs, options=options)
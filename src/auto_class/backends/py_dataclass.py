@@ -1,40 +1,894 @@
 from auto_class import intermediate_representation as ir
 
-from typing import List, Set
-from textwrap import indent, dedent
+from functools import wraps
+from io import StringIO
+import keyword
+import os
+import re
+from typing import List, Set, Tuple, Dict, Any, Callable, IO, Iterator, Union
 
-from ordered_set import OrderedSet
 
+# Types which aren't builtins, and the modules they need to be imported from
+EXTERNAL_TYPES = {'datetime': 'datetime', 'date': 'datetime', 'UUID': 'uuid'}
 
-class ImportRegistry:
-    """This class acts as a global registry of all external names which need to be imported from external modules.
-    This includes all type names which need to be imported from the `typing` module in the
-    generated dataclass definition module (ie List, Dict, Any, etc)"""
-    types: Set[str] = {'ClassVar', 'Type'}
-    dc_field = False
+# Names which generated modules import or define themselves. A generated class with one of these names (ie a class
+# `Type` made from a `type` key) would shadow it, so it's renamed with a trailing underscore (see `safe_class_name()`)
+RESERVED_NAMES = {
+    'Any', 'ClassVar', 'Dict', 'List', 'Literal', 'Mapping', 'NamedTuple', 'Optional', 'Set', 'Tuple', 'Type', 'Union',
+    'Schema', 'LazySchema', 'BatchIO', 'MappingProxyType', 'UUID', 'datetime', 'date', 'field', 'dataclass',
+    'dataclasses', 'add_schema', 'class_schema', 'sys', 'threading', 'intern',
+}
+
+# Replaces `from marshmallow_dataclass import dataclass` in modules generated with the `slots` option.
+# `dataclass(slots=True)` only exists in python 3.10+, so on older versions the class is rebuilt with `__slots__` after
+# `dataclasses.dataclass()` is done with it (the way `dataclasses` itself does it). Either way, this happens before
+# marshmallow_dataclass builds a Schema for the class, so the Schema loads instances of the slotted class
+SLOTS_DATACLASS = """
+if sys.version_info >= (3, 10):
+    def dataclass(cls):
+        return add_schema(dataclasses.dataclass(cls, slots=True))
+else:
+    def dataclass(cls):
+        cls = dataclasses.dataclass(cls)
+        names = tuple(f.name for f in dataclasses.fields(cls))
+        namespace = dict(cls.__dict__)
+        for name in names + ('__dict__', '__weakref__'):
+            # field defaults live on in the generated __init__, and would clash with the slots
+            namespace.pop(name, None)
+        namespace['__slots__'] = names
+        slotted = type(cls)(cls.__name__, cls.__bases__, namespace)
+        slotted.__qualname__ = cls.__qualname__
+        return add_schema(slotted)"""
+
+# Replaces `from marshmallow_dataclass import dataclass` in modules generated with the `lazy_schema` option (but not
+# the `slots` option, which has its own `dataclass()`)
+PLAIN_DATACLASS = """
+
+def dataclass(cls):
+    return add_schema(dataclasses.dataclass(cls))"""
+
+# Replaces marshmallow_dataclass's `add_schema()` in modules generated with the `lazy_schema` option.
+# Versions of marshmallow_dataclass before 8.0 build every class's Schema as soon as the class is defined, which makes
+# up most of the time it takes to import a big generated module
+LAZY_SCHEMA = """
+
+class LazySchema:
+    \"\"\"Builds the marshmallow schema of the class it's on the first time it's accessed, and replaces itself with
+    it\"\"\"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.building = False
+
+    def __get__(self, instance, owner):
+        with self.lock:
+            if self.building:
+                # marshmallow_dataclass looks at every attribute of a class while it builds the class's schema
+                return None
+            # looked up through a subclass, the schema is built for (and stored on) the class this is defined on
+            for cls in owner.__mro__:
+                schema = cls.__dict__.get('Schema')
+                if schema is self:
+                    self.building = True
+                    try:
+                        cls.Schema = class_schema(cls)
+                    finally:
+                        self.building = False
+                    return cls.__dict__['Schema']
+                if schema is not None:
+                    # another thread built it while we waited for the lock
+                    return schema
+
+
+def add_schema(cls):
+    cls.Schema = LazySchema()
+    return cls"""
+
+# Base class of every class in modules generated with the `batch_io` option. Records are loaded and dumped with a
+# single Schema instance per class, created the first time it's needed (marshmallow schemas can be shared between
+# threads once they're created), or with the class's `from_dict()`/`to_dict()` methods when there are any (see
+# `BATCH_IO_FAST`)
+BATCH_IO = """
+
+class BatchIO:
+    \"\"\"Loads and dumps any number of records at a time\"\"\"
+    __slots__ = ()
+    _schema_lock = threading.Lock()
+
+    @classmethod
+    def _shared_schema(cls):
+        \"\"\"the Schema instance this class loads and dumps records with\"\"\"
+        schema = cls.__dict__.get('_schema_instance')
+        if schema is None:
+            with cls._schema_lock:
+                schema = cls.__dict__.get('_schema_instance')
+                if schema is None:
+                    schema = cls._schema_instance = cls.Schema()
+        return schema
+
+    @classmethod
+    def _loader(cls):
+        return cls._shared_schema().load
 
     @classmethod
-    def register_type(cls, typ: str):
-        cls.types.add(typ)
+    def _dumper(cls):
+        return cls._shared_schema().dump
 
     @classmethod
-    def get_types_import_string(cls):
-        """Returns a string like `from typing import List, Set, Union`"""
-        type_str = ', '.join(cls.types)
-        return f"from typing import {type_str}"
+    def load_many(cls, records):
+        \"\"\"loads every record in `records` (any iterable of dicts) into a list\"\"\"
+        load = cls._loader()
+        return [load(record) for record in records]
 
     @classmethod
-    def get_import_stmts(cls):
-        statements = f"""
-            {cls.get_types_import_string()}
-            {'from dataclasses import field' if cls.dc_field else ''}
-            from marshmallow import Schema
-            from marshmallow_dataclass import dataclass
-            
-            """
-        statements = dedent(statements)
-        return statements
+    def iter_load(cls, records):
+        \"\"\"loads the records in `records` one at a time, as they're needed\"\"\"
+        load = cls._loader()
+        for record in records:
+            yield load(record)
+
+    @classmethod
+    def dump_many(cls, objs):
+        \"\"\"dumps every object in `objs` (any iterable of instances of this class) into a list\"\"\"
+        dump = cls._dumper()
+        return [dump(obj) for obj in objs]
+
+    @classmethod
+    def iter_dump(cls, objs):
+        \"\"\"dumps the objects in `objs` one at a time, as they're needed\"\"\"
+        dump = cls._dumper()
+        for obj in objs:
+            yield dump(obj)"""
+
+# `BatchIO` loaders for modules generated with both the `batch_io` and `fast_io` options
+BATCH_IO_FAST = """
+
+    @classmethod
+    def _loader(cls):
+        return cls.from_dict
+
+    @classmethod
+    def _dumper(cls):
+        return cls.to_dict"""
+
+# `typing.Literal` only exists in python 3.8+. marshmallow_dataclass depends on `typing_extensions` (through
+# `typing_inspect`), which has it for older versions
+LITERAL_IMPORT = """
+try:
+    from typing import Literal
+except ImportError:
+    from typing_extensions import Literal"""
+
+# Conversions from the json representation of scalar types to the values marshmallow would load for them, and back,
+# used by the `from_dict()`/`to_dict()` methods generated with the `fast_io` option. Every other scalar type is passed
+# through as it is. Ints are converted because they can come from strings (see `analyze.STRING_FORMATS`).
+# `datetime.fromisoformat()` only accepts a trailing `Z` in python 3.11+ (and before that, only the forms
+# `datetime.isoformat()` writes, which are the only ones `analyze` takes for datetimes)
+SCALAR_LOADERS = {
+    'int': 'int({})',
+    'datetime': "datetime.fromisoformat({}.replace('Z', '+00:00'))",
+    'date': 'date.fromisoformat({})',
+    'UUID': 'UUID({})',
+}
+SCALAR_DUMPERS = {'datetime': '{}.isoformat()', 'date': '{}.isoformat()', 'UUID': 'str({})'}
+
+
+def get_opts(options: Dict = None) -> Dict:
+    """Options for this backend:
+        hoist: define every nested class at the top level of the module instead of inside the class that uses it, and
+            define classes with identical structures only once (see `hoist_dataclasses()`)
+        slots: give every generated class `__slots__` instead of a per-instance `__dict__` (see `SLOTS_DATACLASS`)
+        lazy_schema: build each generated class's marshmallow Schema the first time it's used, instead of when the
+            class is defined (see `LAZY_SCHEMA`)
+        fast_io: give every generated class a `from_dict()` class method and a `to_dict()` method, which load and dump
+            the same data as its `Schema` does, without marshmallow and without validation (see `render_loader()`).
+            The one difference is in members which can be an `int` or a `float`: the `Schema` loads a float as an int
+            when `int` comes first (ie `2.5` as `2`), but `from_dict()` keeps every number as it is
+        batch_io: give every generated class `load_many()`, `iter_load()`, `dump_many()` and `iter_dump()` class
+            methods, which load and dump any iterable of records (see `BATCH_IO`)
+        lazy_nested: have `from_dict()` leave nested classes, sequences of classes and hash tables in the data until
+            they're first used (see `lazy_members()`). Implies `fast_io`
+    """
+    if options is None:
+        options = dict()
+    default_options = dict(hoist=False, slots=False, lazy_schema=False, fast_io=False, batch_io=False,
+                           lazy_nested=False)
+    default_options.update(options)
+    options = default_options
+    if options['lazy_nested']:
+        options['fast_io'] = True
+    return options
+
+
+def safe_class_name(name: str) -> str:
+    """`name`, with underscores added to the end until it isn't one of the `RESERVED_NAMES`"""
+    while name in RESERVED_NAMES:
+        name += '_'
+    return name
+
+
+class GenerationContext:
+    """Everything collected during a single generation run: the names which need to be imported from external modules
+    in the generated module (ie `List`, `Dict` and `Any` from `typing`), the names given to classes, and the render
+    cache, along with the options for the run.
+
+    Each call to `generate_dataclass_definitions()` gets its own context, which is passed through all of the rendering,
+    so independent generation runs share no state and can safely run at the same time in different threads.
+
+    The context also holds the dispatch tables types are rendered and converted with, so that other backends can
+    reuse the rendering in this module with some of the tables' entries replaced (see `py_namedtuple`)"""
+
+    def __init__(self, options: Dict = None):
+        self.options = get_opts(options)
+        self.types: Set[str] = {'ClassVar', 'Type'}
+        self.imports: Set[Tuple[str, str]] = set()
+        self.dc_field = False
+        # id(data class) -> the name it's defined under, for classes which had to be renamed
+        self.class_names: Dict[int, str] = {}
+        self.cache = RenderCache(self.class_names)
+        self.type_renderers = TYPE_RENDERERS
+        self.loaders = LOADERS
+        self.dumpers = DUMPERS
+
+    def class_name(self, dc: ir.DataClass) -> str:
+        name = self.class_names.get(id(dc))
+        return safe_class_name(dc.name) if name is None else name
+
+    def sequence_class(self, node: ir.Sequence) -> str:
+        """the class of the values a sequence is loaded into"""
+        return node.name
+
+    def hashtable_class(self, node: ir.HashTable) -> str:
+        """the class of the values a hash table is loaded into"""
+        return 'dict'
+
+    def register_type(self, typ: str):
+        self.types.add(typ)
+
+    def register_import(self, module: str, name: str):
+        """registers a name to be imported from a module other than `typing` (ie `from uuid import UUID`)"""
+        self.imports.add((module, name))
+
+    def get_types_import_string(self):
+        """Returns a string like `from typing import List, Set, Union`, followed by `LITERAL_IMPORT` if `Literal` is
+        needed"""
+        type_str = ', '.join(sorted(self.types - {'Literal'}))
+        statement = f"from typing import {type_str}"
+        if 'Literal' in self.types:
+            statement += LITERAL_IMPORT
+        return statement
+
+    def get_import_stmts(self):
+        statements = ['', self.get_types_import_string()]
+        statements.extend(f"from {module} import {name}" for module, name in sorted(self.imports))
+        statements.append('from dataclasses import field' if self.dc_field else '')
+        statements.append('from marshmallow import Schema')
+        slots, lazy = self.options['slots'], self.options['lazy_schema']
+        if slots or lazy:
+            # the module defines its own `dataclass()`
+            statements.append(f"from marshmallow_dataclass import {'class_schema' if lazy else 'add_schema'}")
+            statements.append('import dataclasses')
+            if slots:
+                statements.append('import sys')
+            if lazy or self.options['batch_io']:
+                statements.append('import threading')
+            if lazy:
+                statements.append(LAZY_SCHEMA)
+            statements.append(SLOTS_DATACLASS if slots else PLAIN_DATACLASS)
+        else:
+            statements.append('from marshmallow_dataclass import dataclass')
+            if self.options['batch_io']:
+                statements.append('import threading')
+        if self.options['batch_io']:
+            statements.append(BATCH_IO + (BATCH_IO_FAST if self.options['fast_io'] else ''))
+        statements.extend(['', ''])
+        return '\n'.join(statements)
+
+
+def _structure(node, class_keys: Dict[int, Any]) -> tuple:
+    """A hashable description of everything about `node` which affects how it's rendered.
+    Data classes are described by their key in `class_keys` (by id), or by their name if they aren't in it"""
+    def structure(n):
+        return _structure(n, class_keys)
+
+    if isinstance(node, ir.Member):
+        _validate_default(node)
+        # `type()` keeps defaults like `1` and `True` (which are equal) apart
+        return ('Member', node.name, tuple(map(structure, node.types)), type(node.default), node.default,
+                node.optional, node.custom_field)
+    if isinstance(node, ir.DataClass):
+        return ('DataClass', class_keys.get(id(node), node.name))
+    if isinstance(node, ir.HashTable):
+        return ('HashTable', structure(node.key), tuple(map(structure, node.values)))
+    if isinstance(node, ir.Sequence):
+        return ('Sequence', node.name, tuple(map(structure, node.types)))
+    if isinstance(node, ir.Literal):
+        return ('Literal', node.name, tuple(node.values))
+    return ('Type', node.name)
+
+
+class RenderCache:
+    """Remembers everything rendered during a single generation run (see `GenerationContext`), so that each distinct
+    member is rendered only once, no matter how many times it appears in the IR.
+
+    Nodes are looked up by their structure rather than their identity: every node gets a structure id, which is the
+    same for any two nodes with the same class and contents. A data class is identified by the name it's defined under
+    (see `GenerationContext.class_names`) alone, since that's all that gets rendered where it's used as a type. This
+    also means structures never have to be worked out through nested classes, no matter how deeply they're nested"""
+
+    def __init__(self, class_names: Dict[int, str] = None):
+        self.class_names = {} if class_names is None else class_names
+        self.structure_ids: Dict[int, int] = {}  # id(node) -> structure id
+        self.structures: Dict[tuple, int] = {}
+        self.renders: Dict[Tuple[str, int], Any] = {}
+        # keeps every node we've given a structure id to alive, so that their `id()`s can't be reused
+        self._nodes = []
+
+    def structure_id(self, node) -> int:
+        sid = self.structure_ids.get(id(node))
+        if sid is None:
+            sid = self.structures.setdefault(_structure(node, self.class_names), len(self.structures))
+            self.structure_ids[id(node)] = sid
+            self._nodes.append(node)
+        return sid
+
+    def render(self, what: str, node, render: Callable[[Any, GenerationContext], Any], context: GenerationContext
+               ) -> Any:
+        key = (what, self.structure_id(node))
+        try:
+            return self.renders[key]
+        except KeyError:
+            result = self.renders[key] = render(node, context)
+            return result
+
+
+def cached(render: Callable[[Any, GenerationContext], Any]) -> Callable[[Any, GenerationContext], Any]:
+    """Makes a rendering function return its previous result for any node with the same structure as one it has
+    already rendered in the same generation context.
+    Anything a render registers in the context (like imports) is registered the first time, so skipping it later is
+    safe"""
+    @wraps(render)
+    def cached_render(node, context: GenerationContext):
+        return context.cache.render(render.__name__, node, render, context)
+    return cached_render
+
+
+class Emitter:
+    """Writes lines of code to a file-like `sink` as they're generated, indented to the current indentation `level`.
+    Nothing is ever re-indented or joined into bigger strings, so emitting code takes time proportional to the size of
+    the output, no matter how deeply it's nested"""
+
+    def __init__(self, sink: IO[str], indentation: str = ' ' * 4):
+        self.sink = sink
+        self.level = 0
+        self.indentation = indentation
+
+    def line(self, text: str = ''):
+        # like `textwrap.indent()`, blank lines are left blank
+        if text:
+            self.sink.write(self.indentation * self.level)
+            self.sink.write(text)
+        self.sink.write('\n')
+
+
+def _dispatch(table: Dict[type, Callable], node) -> Callable:
+    """Looks up the function for `node` in a table keyed by IR class. Subclasses of IR classes use their base class's
+    function (the lookup is cached after the first one)"""
+    cls = type(node)
+    try:
+        return table[cls]
+    except KeyError:
+        for base in cls.__mro__:
+            if base in table:
+                table[cls] = table[base]
+                return table[base]
+        raise Exception(f'py_dataclass backend does not know how to render {cls.__name__} objects')
+
+
+def _is_none(t: ir.Type) -> bool:
+    return t.name == 'None' and not isinstance(t, (ir.Sequence, ir.HashTable, ir.DataClass))
+
+
+def _is_external(t: ir.Type) -> bool:
+    return t.name in EXTERNAL_TYPES and not isinstance(t, (ir.Sequence, ir.HashTable, ir.DataClass))
+
+
+def _unique(types: List[ir.Type]) -> List[ir.Type]:
+    """removes duplicates from `types` (types with the same class and contents), keeping the first of each"""
+    unique = []
+    for t in types:
+        if t not in unique:
+            unique.append(t)
+    return unique
+
+
+# Types
+
+def _render_scalar(node: ir.Type, context: GenerationContext) -> str:
+    if node.name == 'Any':
+        context.register_type('Any')
+    elif node.name in EXTERNAL_TYPES:
+        context.register_import(EXTERNAL_TYPES[node.name], node.name)
+    return node.name
+
+
+def _render_sequence(node: ir.Sequence, context: GenerationContext) -> str:
+    type_name = node.name.capitalize()  # Ex. `list` become `List`, `set` become `Set`, etc
+    contained_types = ','.join([render_type_definition(t, context) for t in node.types])
+    context.register_type(type_name)
+    return f"{type_name}[{contained_types}]"
+
+
+def _render_hashtable(node: ir.HashTable, context: GenerationContext) -> str:
+    k = render_type_definition(node.key, context)
+    v = get_type_definition(node.values, context)
+    context.register_type('Dict')
+    return f"Dict[{k},{v}]"
+
+
+def _render_dataclass_name(node: ir.DataClass, context: GenerationContext) -> str:
+    return context.class_name(node)
+
+
+def _render_literal(node: ir.Literal, context: GenerationContext) -> str:
+    context.register_type('Literal')
+    return f"Literal[{','.join(map(repr, node.values))}]"
+
+
+TYPE_RENDERERS: Dict[type, Callable[[Any, GenerationContext], str]] = {
+    ir.Type: _render_scalar,
+    ir.Literal: _render_literal,
+    ir.Sequence: _render_sequence,
+    ir.HashTable: _render_hashtable,
+    ir.DataClass: _render_dataclass_name,
+}
+
+
+def render_type_definition(node: ir.Type, context: GenerationContext) -> str:
+    """renders the type annotation for an IR type, ie `List[str]`"""
+    return _dispatch(context.type_renderers, node)(node, context)
+
+
+def get_type_definition(types: List[ir.Type], context: GenerationContext = None) -> str:
+    """renders the type annotation for a value which can be any of `types`, ie `Optional[Union[str,int]]`"""
+    if context is None:
+        context = GenerationContext()
+    return _render_types(types, context)
+
+
+def _render_types(types: List[ir.Type], context: GenerationContext) -> str:
+    t = _unique(types)
+    if any(map(_is_none, t)):
+        if len(t) == 1:
+            context.register_type('Any')
+            return 'Any'
+        t = [v for v in t if not _is_none(v)]
+        optional = True
+    else:
+        optional = False
+    d = ','.join([render_type_definition(v, context) for v in t])
+    if len(t) > 1:
+        context.register_type('Union')
+        d = f'Union[{d}]'
+    if optional:
+        context.register_type('Optional')
+        d = f'Optional[{d}]'
+    return d
+
+
+# Members
+
+def _validate_default(member: ir.Member):
+    try:
+        # only immutable defaults are supported
+        hash(member.default)
+    except TypeError:
+        raise Exception(f'only immutable default values are supported. Member {member.name} was called with mutable '
+                        f'default: {member.default}')
+
+
+def attribute(member: ir.Member) -> str:
+    attribute_name = member.name.lower().replace(' ', '_').replace('-', '_')
+    while not attribute_name[0].isalpha():
+        attribute_name = attribute_name[1:]
+    return attribute_name
+
+
+def default_value(member: ir.Member):
+    if member.default:
+        d = member.default
+        if isinstance(d, str):
+            d = f"'{d}'"
+        return d
+    elif any(map(_is_none, member.types)):
+        return 'None'
+    t = next((t for t in member.types if not _is_none(t)), None)
+    if isinstance(t, ir.Literal):
+        # the default of the literal's type (ie `''`) isn't one of its values
+        return repr(t.values[0])
+    if t is not None and _is_external(t):
+        # `datetime`, `date` and `UUID` can't be built without arguments, so they default to None (see `member_types()`)
+        return 'None'
+    return None
+
+
+def member_types(member: ir.Member) -> List[ir.Type]:
+    """a member's types, including None if the member has to default to None"""
+    if default_value(member) == 'None' and not any(map(_is_none, member.types)):
+        return member.types + [ir.Type('None')]
+    return member.types
+
+
+def default_factory(member: ir.Member, context: GenerationContext = None) -> str:
+    # Get the first type in the set, excluding NoneType
+    t = next(t for t in member.types if not _is_none(t))
+    if isinstance(t, ir.DataClass) and context is not None:
+        return context.class_name(t)
+    return t.name
+
+
+def metadata(member: ir.Member, context: GenerationContext = None):
+    items = []
+    default = default_value(member)
+    if member.optional:
+        if default:
+            d = default
+        else:
+            d = default_factory(member, context)
+        items.append(f"default={d}")
+        items.append(f"missing={d}")
+        items.append(f"required=False")
+    if attribute(member) != member.name:
+        items.append(f"data_key='{member.name}'")
+    if member.custom_field:
+        items.append(f"marshmallow_field={member.custom_field}")
+    if items:
+        items = ', '.join(items)
+        return f"dict({items})"
+    else:
+        return None
+
+
+def render_expression(member: ir.Member, context: GenerationContext) -> str:
+    """renders the right hand side of a member declaration, ie `field(default_factory=list)`"""
+    default, meta = default_value(member), metadata(member, context)
+    if default and not meta:
+        # If we can get away with it, we always want to try and return a non-field expression
+        # field expression is `= field(default='blah')`
+        # non-field expression is `= 'blah'`.
+        # field expression is only required when there is no default AND when there is metadata to capture
+        return default
+
+    elements = []
+    if default:
+        elements.append(f'default={default}')
+    else:
+        elements.append(f"default_factory={default_factory(member, context)}")
+    if meta:
+        elements.append(f"metadata={meta}")
+    elements = ', '.join(elements)
+    context.dc_field = True
+    return f"field({elements})"
+
+
+@cached
+def render_line(member: ir.Member, context: GenerationContext) -> str:
+    """the line declaring a member, ie `name: str = 'hello'`"""
+    return f"{attribute(member)}: {get_type_definition(member_types(member), context)} = " \
+           f"{render_expression(member, context)}"
+
+
+def embedded_dataclasses(types: List[ir.Type]) -> Iterator[ir.DataClass]:
+    """the data classes which need to be defined before a member with these types, in the order they appear"""
+    for t in types:
+        if isinstance(t, ir.DataClass):
+            yield t
+        elif isinstance(t, ir.Sequence):
+            yield from embedded_dataclasses(t.types)
+        elif isinstance(t, ir.HashTable):
+            yield from embedded_dataclasses(t.values)
+
+
+# Loaders and dumpers
+
+def _class_ref(dc: ir.DataClass, owner: str, context: GenerationContext) -> str:
+    """how the methods of a class refer to a class it uses. Nested classes are attributes of `owner` (`cls` or
+    `self`)"""
+    if context.options['hoist']:
+        return context.class_name(dc)
+    return f"{owner}.{context.class_name(dc)}"
+
 
+def _load_scalar(node: ir.Type, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    template = SCALAR_LOADERS.get(node.name)
+    return template.format(value) if template else value
+
+
+def _load_literal(node: ir.Literal, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    if node.name != 'str':
+        return _load_scalar(node, value, owner, depth, context)
+    # every instance shares the same copy of each string, which also makes comparing them an identity check
+    context.register_import('sys', 'intern')
+    return f"intern({value})"
+
+
+def _load_sequence(node: ir.Sequence, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    item = f"v{depth}"
+    conversion = _convert_types(context.loaders, node.types, item, owner, depth + 1, context)
+    if node.name == 'list':
+        # lists are loaded as they are, unless their items need converting
+        return value if conversion == item else f"[{conversion} for {item} in {value}]"
+    if node.name == 'set':
+        return f"set({value})" if conversion == item else f"{{{conversion} for {item} in {value}}}"
+    return f"{node.name}({value})" if conversion == item else f"{node.name}({conversion} for {item} in {value})"
+
+
+def _load_hashtable(node: ir.HashTable, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    k, v = f"k{depth}", f"v{depth}"
+    key = _convert_types(context.loaders, [node.key], k, owner, depth + 1, context)
+    values = _convert_types(context.loaders, node.values, v, owner, depth + 1, context)
+    if key == k and values == v:
+        return value
+    return f"{{{key}: {values} for {k}, {v} in {value}.items()}}"
+
+
+def _load_dataclass(node: ir.DataClass, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    return f"{_class_ref(node, owner, context)}.from_dict({value})"
+
+
+def _dump_scalar(node: ir.Type, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    template = SCALAR_DUMPERS.get(node.name)
+    return template.format(value) if template else value
+
+
+def _dump_sequence(node: ir.Sequence, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    item = f"v{depth}"
+    conversion = _convert_types(context.dumpers, node.types, item, owner, depth + 1, context)
+    return f"list({value})" if conversion == item else f"[{conversion} for {item} in {value}]"
+
+
+def _dump_hashtable(node: ir.HashTable, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    v = f"v{depth}"
+    values = _convert_types(context.dumpers, node.values, v, owner, depth + 1, context)
+    return f"dict({value})" if values == v else f"{{k{depth}: {values} for k{depth}, {v} in {value}.items()}}"
+
+
+def _dump_dataclass(node: ir.DataClass, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    return f"{value}.to_dict()"
+
+
+LOADERS: Dict[type, Callable[[Any, str, str, int, GenerationContext], str]] = {
+    ir.Type: _load_scalar,
+    ir.Literal: _load_literal,
+    ir.Sequence: _load_sequence,
+    ir.HashTable: _load_hashtable,
+    ir.DataClass: _load_dataclass,
+}
+
+DUMPERS: Dict[type, Callable[[Any, str, str, int, GenerationContext], str]] = {
+    ir.Type: _dump_scalar,
+    ir.Sequence: _dump_sequence,
+    ir.HashTable: _dump_hashtable,
+    ir.DataClass: _dump_dataclass,
+}
+
+
+def _instance_check(table: Dict[type, Callable], node: ir.Type, owner: str, context: GenerationContext
+                    ) -> Union[str, None]:
+    """The class to check a value against to tell which of the types in a union it is. When loading, that's the json
+    type the value would be represented as, and when dumping, it's the type of the loaded value.
+    None for types which can't be told apart from others (ie `int` and `float` in json), which are passed through"""
+    loading = table is context.loaders
+    if isinstance(node, ir.DataClass):
+        return 'dict' if loading else _class_ref(node, owner, context)
+    if isinstance(node, ir.HashTable):
+        return 'dict' if loading else context.hashtable_class(node)
+    if isinstance(node, ir.Sequence):
+        return 'list' if loading else context.sequence_class(node)
+    if node.name in EXTERNAL_TYPES or node.name == 'str':
+        # like a union field in a Schema, a `str` takes any string before the types after it get a chance to
+        return 'str' if loading else node.name
+    return None
+
+
+def _convert_types(table: Dict[type, Callable], types: List[ir.Type], value: str, owner: str, depth: int,
+                   context: GenerationContext) -> str:
+    """renders an expression which converts `value` (an expression itself) from any of `types`, with the converters
+    in `table`. Returns `value` unchanged if it doesn't need converting"""
+    t = _unique(types)
+    nullable = any(map(_is_none, t))
+    t = [v for v in t if not _is_none(v)]
+    if len(t) == 1:
+        conversion = _dispatch(table, t[0])(t[0], value, owner, depth, context)
+    else:
+        # a union: the value is converted by the first type it's an instance of
+        checks: Dict[str, str] = {}
+        for v in t:
+            check = _instance_check(table, v, owner, context)
+            if check is not None:
+                checks.setdefault(check, _dispatch(table, v)(v, value, owner, depth, context))
+        conversion = value
+        for check, converted in reversed(list(checks.items())):
+            if converted != value:
+                conversion = f"({converted} if isinstance({value}, {check}) else {conversion})"
+    if nullable and conversion != value:
+        conversion = f"(None if {value} is None else {conversion})"
+    return conversion
+
+
+def _load_member(member: ir.Member, owner: str, context: GenerationContext) -> str:
+    key = repr(member.name)
+    value = f"data[{key}]"
+    conversion = _convert_types(context.loaders, member_types(member), value, owner, 0, context)
+    default = default_value(member)
+    if default:
+        if conversion == value:
+            return f"data.get({key}, {default})"
+    else:
+        t = next(t for t in member.types if not _is_none(t))
+        factory = _class_ref(t, owner, context) if isinstance(t, ir.DataClass) else t.name
+        default = f"{factory}()"
+    return f"{conversion} if {key} in data else {default}"
+
+
+@cached
+def render_loader(member: ir.Member, context: GenerationContext) -> str:
+    """The value `from_dict()` loads a member with, ie `data.get('name', 'hello')`.
+    Members missing from the data get the same defaults they would get from the class's `Schema`. Values are converted
+    to the member's type (as far as they need to be) but not validated, which is what the `Schema` is for. Numbers in
+    a union of `int` and `float` are passed through, where the `Schema` would truncate floats (see `get_opts()`)"""
+    return _load_member(member, 'cls', context)
+
+
+@cached
+def render_lazy_loader(member: ir.Member, context: GenerationContext) -> str:
+    """The value `__getattr__()` loads a lazy member with the first time it's used (see `lazy_members()`)"""
+    return _load_member(member, 'self', context)
+
+
+@cached
+def render_dumper(member: ir.Member, context: GenerationContext) -> str:
+    """The item `to_dict()` returns for a member, ie `'sub-class': self.sub_class.to_dict()`"""
+    value = _convert_types(context.dumpers, member_types(member), f"self.{attribute(member)}", 'self', 0, context)
+    return f"{member.name!r}: {value}"
+
+
+def lazy_members(dc: ir.DataClass, context: GenerationContext) -> List[ir.Member]:
+    """The members of a class which are loaded lazily with the `lazy_nested` option: nested classes, sequences of
+    classes, and hash tables.
+
+    `from_dict()` doesn't set lazy members. It keeps the data the instance was loaded from in its `_raw` field instead,
+    and `__getattr__()` (which is only ever called for attributes which aren't set) loads each lazy member from it the
+    first time it's used, and sets it. From then on, the member is an ordinary attribute"""
+    if not context.options['lazy_nested']:
+        return []
+    return [member for member in dc.members
+            if any(isinstance(t, (ir.DataClass, ir.HashTable)) for t in member.types)
+            or any(embedded_dataclasses(member.types))]
+
+
+def _fast_io_lines(dc: ir.DataClass, context: GenerationContext) -> Iterator[Tuple[int, str]]:
+    lazy = lazy_members(dc, context)
+    yield 0, ''
+    yield 0, '@classmethod'
+    yield 0, f"def from_dict(cls, data: dict) -> '{context.class_name(dc)}':"
+    if lazy:
+        yield 1, 'obj = cls.__new__(cls)'
+        for member in dc.members:
+            if member not in lazy:
+                yield 1, f"obj.{attribute(member)} = {render_loader(member, context)}"
+        yield 1, 'obj._raw = data'
+        yield 1, 'return obj'
+    else:
+        yield 1, 'return cls('
+        for member in dc.members:
+            yield 2, f"{attribute(member)}={render_loader(member, context)},"
+        yield 1, ')'
+    yield 0, ''
+    yield 0, 'def to_dict(self) -> dict:'
+    yield 1, 'return {'
+    for member in dc.members:
+        yield 2, render_dumper(member, context) + ','
+    yield 1, '}'
+    if lazy:
+        yield 0, ''
+        yield 0, 'def __getattr__(self, name):'
+        # anything else (`_raw` included, for instances which weren't loaded with `from_dict()`) just isn't there
+        yield 1, f"if name not in {tuple(attribute(member) for member in lazy)!r}:"
+        yield 2, 'raise AttributeError(name)'
+        yield 1, 'data = self._raw'
+        for i, member in enumerate(lazy):
+            yield 1, f"{'elif' if i else 'if'} name == '{attribute(member)}':"
+            yield 2, f"value = {render_lazy_loader(member, context)}"
+        yield 1, 'setattr(self, name, value)'
+        yield 1, 'return value'
+
+
+# Data classes
+
+def _class_lines(dc: ir.DataClass, context: GenerationContext) -> Iterator[Tuple[int, Union[str, ir.DataClass]]]:
+    """Yields the lines of a data class definition as (indentation, line) pairs, where the indentation is relative to
+    the class itself. Nested classes are yielded as they are, to be emitted in their place (unless they're hoisted)"""
+    yield 0, ''
+    yield 0, '@dataclass'
+    yield 0, f"class {context.class_name(dc)}{'(BatchIO)' if context.options['batch_io'] else ''}:"
+    hoisted = context.options['hoist']
+    defined = set()
+    for member in dc.members:
+        if not hoisted:
+            for nested in embedded_dataclasses(member.types):
+                if context.options['fast_io']:
+                    # a class used by more than one member is only defined once (see `rename_shadowed_dataclasses()`)
+                    if id(nested) in defined:
+                        continue
+                    defined.add(id(nested))
+                yield 1, nested
+                yield 1, ''
+        yield 1, render_line(member, context)
+    lazy = lazy_members(dc, context)
+    if lazy:
+        yield 1, '_raw: Any = field(default=None, init=False, repr=False, compare=False)'
+    yield 1, 'Schema: ClassVar[Type[Schema]] = Schema'
+    if context.options['fast_io']:
+        for offset, line in _fast_io_lines(dc, context):
+            yield offset + 1, line
+    if not context.options['slots']:
+        # `__getattr__()` is only called for attributes which aren't found on the class either, so lazy members can't
+        # have class attributes (which is where dataclasses puts default values)
+        for member in lazy:
+            if default_value(member):
+                yield 0, f"del {context.class_name(dc)}.{attribute(member)}"
+
+
+def emit_definition(dc: ir.DataClass, emitter: Emitter, context: GenerationContext):
+    """Writes the definition of a data class (and the definitions of the classes nested in it) to `emitter`, at the
+    emitter's current indentation level.
+    Nested classes are emitted with an explicit stack of line generators rather than by recursion"""
+    base_level = emitter.level
+    stack = [(_class_lines(dc, context), base_level)]
+    while stack:
+        lines, level = stack[-1]
+        for offset, line in lines:
+            if isinstance(line, ir.DataClass):
+                stack.append((_class_lines(line, context), level + offset))
+                break
+            emitter.level = level + offset
+            emitter.line(line)
+        else:
+            stack.pop()
+    emitter.level = base_level
+
+
+def _render_dataclass(dc: ir.DataClass, context: GenerationContext) -> str:
+    sink = StringIO()
+    emit_definition(dc, Emitter(sink), context)
+    return sink.getvalue()
+
+
+def _render_member(member: ir.Member, context: GenerationContext) -> str:
+    lines = [_render_dataclass(dc, context) for dc in embedded_dataclasses(member.types)]
+    lines.append(render_line(member, context))
+    return "\n".join(lines)
+
+
+DEFINITION_RENDERERS: Dict[type, Callable[[Any, GenerationContext], str]] = {
+    ir.DataClass: _render_dataclass,
+    ir.Member: _render_member,
+}
+
+
+def render_definition(node: Union[ir.DataClass, ir.Member], context: GenerationContext = None) -> str:
+    """renders the full definition of a data class, or the declaration of a member (along with the definitions of any
+    classes it needs)"""
+    if context is None:
+        context = GenerationContext()
+    return _dispatch(DEFINITION_RENDERERS, node)(node, context)
+
+
+# Everything in this module renders straight from `intermediate_representation` objects. The classes below are only
+# kept for compatibility: `from_ir()` wraps an IR object in one of them to give it the rendering properties that used
+# to live on these classes. Wrapping is shallow (the wrapper shares its children with the original object), so it
+# costs the same no matter how big the IR is
 
 class Type(ir.Type):
 
@@ -43,13 +897,13 @@ class Type(ir.Type):
 
     @classmethod
     def from_ir(cls, base: ir.Type) -> 'Type':
-        obj = cls()
+        obj = cls.__new__(cls)
         obj.__dict__.update(base.__dict__)
         return obj
 
     @property
     def type_definition(self):
-        return self.name
+        return render_type_definition(self, GenerationContext())
 
     def __hash__(self):
         return hash(self.name)
@@ -61,21 +915,6 @@ class Sequence(ir.Sequence, Type):
         if args or kwargs:
             raise Exception('This subclass should not be instantiated directly. Use the `from_ir` class method instead')
 
-    @classmethod
-    def from_ir(cls, base: ir.Sequence) -> 'Sequence':
-        obj = cls()
-        obj.__dict__.update(base.__dict__)
-        obj.types = list(map(from_ir, obj.types))
-        return obj
-
-    @property
-    def type_definition(self):
-        self.types: List[Type]
-        type_name = self.name.capitalize()  # Ex. `list` become `List`, `set` become `Set`, etc
-        contained_types = ','.join([t.type_definition for t in self.types])
-        ImportRegistry.register_type(type_name)
-        return f"{type_name}[{contained_types}]"
-
     def __hash__(self):
         return hash(self.name)
 
@@ -86,23 +925,6 @@ class HashTable(ir.HashTable, Type):
         if args or kwargs:
             raise Exception('This subclass should not be instantiated directly. Use the `from_ir` class method instead')
 
-    @classmethod
-    def from_ir(cls, base: ir.HashTable) -> 'HashTable':
-        obj = cls()
-        obj.__dict__.update(base.__dict__)
-        obj.key = from_ir(base.key)
-        obj.values = list(map(from_ir, obj.values))
-        return obj
-
-    @property
-    def type_definition(self):
-        self.key: Type
-        self.values: List[Type]
-        k = self.key.type_definition
-        v = get_type_definition(self.values)
-        ImportRegistry.register_type('Dict')
-        return f"Dict[{k},{v}]"
-
     def __hash__(self):
         return hash(self.name)
 
@@ -114,26 +936,9 @@ class DataClass(ir.DataClass, Type):
         if args or kwargs:
             raise Exception('This subclass should not be instantiated directly. Use the `from_ir` class method instead')
 
-    @classmethod
-    def from_ir(cls, base: ir.DataClass) -> 'DataClass':
-        obj = cls()
-        obj.__dict__.update(base.__dict__)
-        obj.members = list(map(from_ir, obj.members))
-        return obj
-
     @property
     def definition(self):
-        dfn = f"\n{self.header}\n{self.body}\n"
-        return dfn
-
-    @property
-    def body(self):
-        bod = ''
-        if self.members:
-            self.members: List['Member']
-            bod = '\n'.join([m.definition for m in self.members]) + '\n'
-        bod += 'Schema: ClassVar[Type[Schema]] = Schema'
-        return indent(bod, prefix=' ' * 4)
+        return render_definition(self)
 
     @property
     def header(self):
@@ -151,150 +956,261 @@ class Member(ir.Member):
 
     @classmethod
     def from_ir(cls, base: ir.Member) -> 'Member':
-        obj = cls()
+        obj = cls.__new__(cls)
         obj.__dict__.update(base.__dict__)
-        obj._validate_default()
-        obj.types = list(map(from_ir, obj.types))
+        _validate_default(obj)
         return obj
 
-    def _validate_default(self):
-        try:
-            # only immutable defaults are supported
-            hash(self.default)
-        except TypeError:
-            raise Exception(f'only immutable default values are supported. Member {self.name} was called with mutable '
-                            f'default: {self.default}')
-
     @property
     def definition(self):
-        lines = []
-        lines.extend(self.get_embedded_dataclass_defs(self.types))
-        lines.append(f"{self.attribute}: {get_type_definition(self.types)} = {self.expression}")
-        return "\n".join(lines)
-
-    def get_embedded_dataclass_defs(self, types: List[Type]) -> List[str]:
-        lines = []
-        for type in types:
-            if isinstance(type, DataClass):
-                lines.append(type.definition)
-            if isinstance(type, Sequence):
-                lines.extend(self.get_embedded_dataclass_defs(type.types))
-            if isinstance(type, HashTable):
-                lines.extend(self.get_embedded_dataclass_defs(type.values))
-        return lines
+        return render_definition(self)
 
     @property
     def attribute(self):
-        attribute_name = self.name.lower().replace(' ', '_').replace('-', '_')
-        while not attribute_name[0].isalpha():
-            attribute_name = attribute_name[1:]
-        return attribute_name
+        return attribute(self)
 
     @property
     def expression(self):
-        if self.default_value and not self.metadata:
-            # If we can get away with it, we always want to try and return a non-field expression
-            # field expression is `= field(default='blah')`
-            # non-field expression is `= 'blah'`.
-            # field expression is only required when there is no default AND when there is metadata to capture
-            return self.default_value
-
-        elements = []
-        if self.default_value:
-            elements.append(f'default={self.default_value}')
-        else:
-            elements.append(f"default_factory={self.default_factory}")
-        if self.metadata:
-            elements.append(f"metadata={self.metadata}")
-        elements = ', '.join(elements)
-        ImportRegistry.dc_field = True
-        return f"field({elements})"
+        return render_expression(self, GenerationContext())
 
     @property
     def metadata(self):
-        items = []
-        if self.optional:
-            if self.default_value:
-                d = self.default_value
-            else:
-                d = self.default_factory
-            items.append(f"default={d}")
-            items.append(f"missing={d}")
-            items.append(f"required=False")
-        if self.attribute != self.name:
-            items.append(f"data_key='{self.name}'")
-        if self.custom_field:
-            items.append(f"marshmallow_field={self.custom_field}")
-        if items:
-            items = ', '.join(items)
-            return f"dict({items})"
-        else:
-            return None
+        return metadata(self)
 
     @property
     def default_value(self):
-        if self.default:
-            d = self.default
-            if isinstance(d, str):
-                d = f"'{d}'"
-            return d
-        elif Type('None') in self.types:
-            return 'None'
-        else:
-            return None
+        return default_value(self)
 
     @property
     def default_factory(self):
-        # Get the first type in the set, excluding NoneType
-        t = OrderedSet(self.types)
-        t = next(iter(t - {Type('None')}))
-        return t.name
+        return default_factory(self)
 
     def __hash__(self):
-        return hash((self.name, self.attribute))
+        return hash((self.name, attribute(self)))
 
 
-def get_type_definition(types: List[Type]) -> str:
-    t = OrderedSet(types)
-    if Type('None') in t:
-        if len(t) is 1:
-            ImportRegistry.register_type('Any')
-            return 'Any'
-        t = t - {Type('None')}
-        optional = True
-    else:
-        optional = False
-    d = ','.join([v.type_definition for v in t])
-    if len(t) > 1:
-        ImportRegistry.register_type('Union')
-        d = f'Union[{d}]'
-    if optional:
-        ImportRegistry.register_type('Optional')
-        d = f'Optional[{d}]'
-    return d
+WRAPPERS = {ir.Type: Type, ir.Sequence: Sequence, ir.HashTable: HashTable, ir.DataClass: DataClass, ir.Member: Member}
 
 
 def from_ir(base):
-    """Convert instances of ir base classes to instances of py_dataclass subclasses
-    This is very hacky, and relies on all base classes in ir having equivalents in this module with the same name.
+    """Wraps an IR object in the equivalent class from this module (see the note above `Type`). Only needed for code
+    which uses the old rendering properties. Everything else in this module works on IR objects directly"""
+    return _dispatch(WRAPPERS, base).from_ir(base)
+
+
+def hoist_dataclasses(dataclasses: List[ir.DataClass], context: GenerationContext) -> List[ir.DataClass]:
+    """Finds every distinct data class in `dataclasses` (including the ones nested inside them), and returns them in
+    an order they can be defined in at the top level of a module (each class after the classes it uses).
+
+    Two classes are the same if they have the same name and the same members, with the same types, all the way down.
+    Only the first of each is returned, and every other copy is rendered as a reference to it. Distinct classes with
+    the same name are renamed (`Address`, `Address1`, ...) in `context.class_names`, top-level classes first, so they
+    can all live in the same module"""
+    unique: List[ir.DataClass] = []
+    keys: Dict[int, int] = {}  # id(data class) -> index of the unique class it's a copy of
+    index: Dict[tuple, int] = {}
+    # classes are visited children first, with an explicit stack, so a class's key can refer to its nested classes'
+    stack = [(dc, False) for dc in reversed(dataclasses)]
+    while stack:
+        dc, expanded = stack.pop()
+        if id(dc) in keys:
+            continue
+        if not expanded:
+            stack.append((dc, True))
+            nested = [n for member in dc.members for n in embedded_dataclasses(member.types)]
+            stack.extend((n, False) for n in reversed(nested) if id(n) not in keys)
+            continue
+        key = (dc.name,) + tuple(_structure(member, keys) for member in dc.members)
+        i = index.get(key)
+        if i is None:
+            i = index[key] = len(unique)
+            unique.append(dc)
+        keys[id(dc)] = i
+
+    names: Dict[int, str] = {}  # index of a unique class -> the name it's defined under
+    counters: Dict[str, int] = {}
+    taken = set()
+    top_level = [keys[id(dc)] for dc in dataclasses]
+    for i in top_level + list(range(len(unique))):
+        if i in names:
+            continue
+        name = base = safe_class_name(unique[i].name)
+        while name in taken:
+            counters[base] = counters.get(base, 0) + 1
+            name = f"{base}{counters[base]}"
+        taken.add(name)
+        names[i] = name
+    for dc_id, i in keys.items():
+        context.class_names[dc_id] = names[i]
+    return unique
+
+
+def rename_shadowed_dataclasses(dataclasses: List[ir.DataClass], context: GenerationContext):
+    """Renames (in `context.class_names`) nested classes which would otherwise be defined under the same name as a
+    different class nested in the same class (`Address`, `Address1`, ...).
+    Each member's type annotation refers to the class defined just before it, but methods run after the whole class
+    body, when a name refers to the last class defined under it, so the methods generated with the `fast_io` option
+    need every nested class to have a name of its own (and to be defined only once)"""
+    stack = list(dataclasses)
+    while stack:
+        dc = stack.pop()
+        taken: Dict[str, int] = {}  # name -> id of the class defined under it
+        counters: Dict[str, int] = {}
+        for member in dc.members:
+            for nested in embedded_dataclasses(member.types):
+                name = base = context.class_name(nested)
+                if taken.get(name, id(nested)) == id(nested):
+                    if name not in taken:
+                        taken[name] = id(nested)
+                        stack.append(nested)
+                    continue
+                while name in taken:
+                    counters[base] = counters.get(base, 0) + 1
+                    name = f"{base}{counters[base]}"
+                taken[name] = id(nested)
+                context.class_names[id(nested)] = name
+                stack.append(nested)
+
+
+def write_dataclass_definitions(rs: ir.ResultSet, sink: IO[str], context: GenerationContext = None,
+                                options: Dict = None):
+    """Renders `rs` into the source code of a python module, and writes it to `sink` (any file-like object with a
+    `write()` method) line by line, without ever building the whole module in memory.
+    Every call renders in its own `GenerationContext` (unless one is given), so calls can run concurrently
+
+    :param options: see `get_opts()`. Ignored if a context is given
+    """
+    if context is None:
+        context = GenerationContext(options)
+    if context.options['hoist']:
+        dataclasses = hoist_dataclasses(rs.dataclasses, context)
+    else:
+        dataclasses = rs.dataclasses
+        if context.options['fast_io']:
+            rename_shadowed_dataclasses(dataclasses, context)
+
+    _write_module(dataclasses, rs.preamble, sink, context)
+
+
+def _write_module(dataclasses: List[ir.DataClass], preamble: str, sink: IO[str], context: GenerationContext):
+    # The import statements go at the top of the module, but we only know what needs to be imported once every member
+    # (and its loader) has been rendered. These renders are cached, so we render them all first, then emit the module
+    # from the top
+    stack = list(reversed(dataclasses))
+    while stack:
+        dc = stack.pop()
+        if lazy_members(dc, context):
+            # for the `_raw` field
+            context.register_type('Any')
+            context.dc_field = True
+        for member in dc.members:
+            render_line(member, context)
+            if context.options['fast_io']:
+                # loaders can need imports too
+                render_loader(member, context)
+            if not context.options['hoist']:
+                stack.extend(embedded_dataclasses(member.types))
+
+    sink.write(context.get_import_stmts())
+    if preamble:
+        sink.write('\n')
+        sink.write(preamble)
+    emitter = Emitter(sink)
+    for dc in dataclasses:
+        sink.write('\n')
+        emit_definition(dc, emitter, context)
+
+
+def generate_dataclass_definitions(rs: ir.ResultSet, context: GenerationContext = None, options: Dict = None) -> str:
+    """Renders `rs` into the source code of a python module (see `write_dataclass_definitions()`)"""
+    sink = StringIO()
+    write_dataclass_definitions(rs, sink, context, options)
+    return sink.getvalue()
+
+
+# The `__init__` module of a package generated by `write_dataclass_package()`
+PACKAGE_INIT = """\"\"\"Generated data classes. Every class lives in a submodule of its own, which is only imported when
+the class is first used, ie by `from package import Class`\"\"\"
+from importlib import import_module
+
+# class name -> the submodule it's defined in
+_MODULES = {{
+{modules}}}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+    value = getattr(import_module(f".{{module}}", __name__), name)
+    # later lookups find the class right here, without calling this function
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+"""
+
+
+def _module_name(class_name: str, taken: Set[str]) -> str:
+    """`AuditInfo` becomes `audit_info`, with underscores added until the name is a free, valid module name"""
+    name = re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', class_name).lower()
+    while keyword.iskeyword(name) or name in taken or name == '__init__':
+        name += '_'
+    taken.add(name)
+    return name
+
+
+def iter_dataclass_package(rs: ir.ResultSet, options: Dict = None) -> Iterator[Tuple[str, str]]:
+    """Renders `rs` into the modules of a python package, and yields them one at a time as (module name, source code)
+    pairs, `__init__` first.
+
+    Every class is hoisted (see `hoist_dataclasses()`) into a submodule of its own, which imports the classes it uses
+    from their submodules. The package's `__init__` imports a class's submodule the first time the class is looked up
+    on the package (with a module-level `__getattr__()`, which needs python 3.7+), so importing one class only ever
+    compiles that class and the classes it uses, no matter how big the package is
+
+    :param options: see `get_opts()`. `hoist` is always on
     """
-    class_name = base.__class__.__name__
-    local_equivalent = globals()[class_name]
+    options = dict(options or {}, hoist=True)
+    context = GenerationContext(options)
+    dataclasses = hoist_dataclasses(rs.dataclasses, context)
+    taken: Set[str] = set()
+    modules = {context.class_name(dc): _module_name(context.class_name(dc), taken) for dc in dataclasses}
+    yield '__init__', PACKAGE_INIT.format(modules=''.join(f"    {k!r}: {v!r},\n" for k, v in modules.items()))
 
-    new = local_equivalent.from_ir(base)
+    for dc in dataclasses:
+        # each module has its own imports, but class names are shared by the whole package
+        module_context = GenerationContext(options)
+        module_context.class_names = context.class_names
+        module_context.cache = RenderCache(context.class_names)
+        for member in dc.members:
+            for nested in embedded_dataclasses(member.types):
+                name = context.class_name(nested)
+                module_context.register_import(f".{modules[name]}", name)
+        sink = StringIO()
+        _write_module([dc], rs.preamble, sink, module_context)
+        yield modules[context.class_name(dc)], sink.getvalue()
 
-    return new
 
+def write_dataclass_package(rs: ir.ResultSet, path: str, options: Dict = None):
+    """Renders `rs` into a python package in the directory at `path` (see `iter_dataclass_package()`), creating the
+    directory if needed. Modules are written as they're rendered
+
+    :param options: see `get_opts()`. `hoist` is always on
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, source in iter_dataclass_package(rs, options):
+        with open(os.path.join(path, f"{name}.py"), 'w') as f:
+            f.write(source)
 
-def generate_dataclass_definitions(rs: ir.ResultSet) -> str:
-    dataclasses = [from_ir(dc) for dc in rs.dataclasses]
 
-    # We need to include import statements at the top of our result stack, but we need to generate dataclass definitions
-    # in order to populate the import statements.
-    # To get around this, we'll build our result stack in reverse
-    result = [dc.definition for dc in dataclasses]
-    if rs.preamble:
-        result.insert(0, rs.preamble)
-    result.insert(0, ImportRegistry.get_import_stmts())
+def generate_dataclass_package(rs: ir.ResultSet, options: Dict = None) -> Dict[str, str]:
+    """Renders `rs` into the modules of a python package (see `iter_dataclass_package()`)
 
-    return '\n'.join(result)
+    :return: the source code of each module, by module name
+    """
+    return dict(iter_dataclass_package(rs, options))
@@ -0,0 +1,200 @@
+"""Renders IR into `typing.NamedTuple` records: immutable, tuple-backed classes which take less memory per instance
+and are faster to create than data classes, for read-only workloads. Records are loaded and dumped with the
+`from_dict()` and `to_dict()` methods generated into them (there's no marshmallow Schema).
+
+Most of the rendering is shared with `py_dataclass`, through a `GenerationContext` with some of its dispatch tables
+replaced: sequences become tuples and hash tables become read-only `Mapping`s (`MappingProxyType`s over a copy of the
+loaded dict)"""
+from auto_class import intermediate_representation as ir
+from auto_class.backends import py_dataclass as pd
+
+from io import StringIO
+from typing import Dict, IO, Iterator, List, Tuple
+
+
+# Class-level defaults for scalar types. Defaults are shared by every instance of a record, so they have to be
+# immutable. Scalars which aren't listed (like `datetime`) default to None
+SCALAR_DEFAULTS = {'str': "''", 'int': '0', 'float': '0.0', 'bool': 'False', 'bytes': "b''"}
+
+
+def get_opts(options: Dict = None) -> Dict:
+    """This backend has no options of its own. Every record is defined once, at the top level of the module (see
+    `py_dataclass.hoist_dataclasses()`), since records can't refer to records nested inside them"""
+    if options is None:
+        options = dict()
+    options = dict(options)
+    options['hoist'] = True
+    return options
+
+
+class GenerationContext(pd.GenerationContext):
+    """A `py_dataclass.GenerationContext` which renders records instead of data classes"""
+
+    def __init__(self, options: Dict = None):
+        super().__init__()
+        self.options = get_opts(options)
+        self.types = {'NamedTuple'}
+        self.type_renderers = TYPE_RENDERERS
+        self.loaders = LOADERS
+
+    def sequence_class(self, node: ir.Sequence) -> str:
+        return 'tuple'
+
+    def hashtable_class(self, node: ir.HashTable) -> str:
+        self.register_import('types', 'MappingProxyType')
+        return 'MappingProxyType'
+
+    def get_import_stmts(self):
+        statements = ['', self.get_types_import_string()]
+        statements.extend(f"from {module} import {name}" for module, name in sorted(self.imports))
+        statements.extend(['', ''])
+        return '\n'.join(statements)
+
+
+# Types
+
+def _render_sequence(node: ir.Sequence, context: GenerationContext) -> str:
+    context.register_type('Tuple')
+    return f"Tuple[{pd.get_type_definition(node.types, context)}, ...]"
+
+
+def _render_hashtable(node: ir.HashTable, context: GenerationContext) -> str:
+    k = pd.render_type_definition(node.key, context)
+    v = pd.get_type_definition(node.values, context)
+    context.register_type('Mapping')
+    return f"Mapping[{k},{v}]"
+
+
+TYPE_RENDERERS = dict(pd.TYPE_RENDERERS)
+TYPE_RENDERERS.update({ir.Sequence: _render_sequence, ir.HashTable: _render_hashtable})
+
+
+def _load_sequence(node: ir.Sequence, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    item = f"v{depth}"
+    conversion = pd._convert_types(context.loaders, node.types, item, owner, depth + 1, context)
+    return f"tuple({value})" if conversion == item else f"tuple({conversion} for {item} in {value})"
+
+
+def _load_hashtable(node: ir.HashTable, value: str, owner: str, depth: int, context: GenerationContext) -> str:
+    context.register_import('types', 'MappingProxyType')
+    loaded = pd._load_hashtable(node, value, owner, depth, context)
+    # the proxy is a view, so it needs a dict of its own, or changes to the loaded data would show through
+    return f"MappingProxyType(dict({value}))" if loaded == value else f"MappingProxyType({loaded})"
+
+
+LOADERS = dict(pd.LOADERS)
+LOADERS.update({ir.Sequence: _load_sequence, ir.HashTable: _load_hashtable})
+
+
+# Members
+
+def default_value(member: ir.Member, context: GenerationContext) -> str:
+    """the class-level default of a member, which members missing from loaded data get too"""
+    default = pd.default_value(member)
+    if default:
+        return str(default)
+    t = next(t for t in member.types if not pd._is_none(t))
+    if isinstance(t, ir.DataClass):
+        return f"{context.class_name(t)}()"
+    if isinstance(t, ir.HashTable):
+        context.register_import('types', 'MappingProxyType')
+        return 'MappingProxyType({})'
+    if isinstance(t, ir.Sequence):
+        return '()'
+    if isinstance(t, ir.Literal):
+        return repr(t.values[0])
+    return SCALAR_DEFAULTS.get(t.name, 'None')
+
+
+def member_types(member: ir.Member, context: GenerationContext) -> List[ir.Type]:
+    """a member's types, including None if the member has to default to None"""
+    if default_value(member, context) == 'None' and not any(map(pd._is_none, member.types)):
+        return member.types + [ir.Type('None')]
+    return member.types
+
+
+@pd.cached
+def render_line(member: ir.Member, context: GenerationContext) -> str:
+    """the line declaring a field, ie `name: str = ''`"""
+    types = member_types(member, context)
+    return f"{pd.attribute(member)}: {pd.get_type_definition(types, context)} = {default_value(member, context)}"
+
+
+@pd.cached
+def render_loader(member: ir.Member, context: GenerationContext) -> str:
+    """The value `from_dict()` builds its record with for a member, ie `data.get('name', '')`
+    (see `py_dataclass.render_loader()`)"""
+    key = repr(member.name)
+    value = f"data[{key}]"
+    conversion = pd._convert_types(context.loaders, member_types(member, context), value, 'cls', 0, context)
+    default = default_value(member, context)
+    if conversion == value:
+        return f"data.get({key}, {default})"
+    return f"{conversion} if {key} in data else {default}"
+
+
+@pd.cached
+def render_dumper(member: ir.Member, context: GenerationContext) -> str:
+    """The item `to_dict()` returns for a member, ie `'sub-class': self.sub_class.to_dict()`"""
+    value = pd._convert_types(context.dumpers, member_types(member, context), f"self.{pd.attribute(member)}", 'self', 0,
+                              context)
+    return f"{member.name!r}: {value}"
+
+
+# Records
+
+def _record_lines(dc: ir.DataClass, context: GenerationContext) -> Iterator[Tuple[int, str]]:
+    yield 0, ''
+    yield 0, f'class {context.class_name(dc)}(NamedTuple):'
+    for member in dc.members:
+        yield 1, render_line(member, context)
+    yield 0, ''
+    yield 1, '@classmethod'
+    yield 1, f"def from_dict(cls, data: dict) -> '{context.class_name(dc)}':"
+    # the tuple is built directly, which skips the NamedTuple's `__new__()` and its keyword arguments
+    yield 2, 'return tuple.__new__(cls, ('
+    for member in dc.members:
+        yield 3, f"{render_loader(member, context)},  # {pd.attribute(member)}"
+    yield 2, '))'
+    yield 0, ''
+    yield 1, 'def to_dict(self) -> dict:'
+    yield 2, 'return {'
+    for member in dc.members:
+        yield 3, render_dumper(member, context) + ','
+    yield 2, '}'
+
+
+def write_namedtuple_definitions(rs: ir.ResultSet, sink: IO[str], context: GenerationContext = None,
+                                 options: Dict = None):
+    """Renders `rs` into the source code of a python module, and writes it to `sink` line by line (see
+    `py_dataclass.write_dataclass_definitions()`)
+
+    :param options: see `get_opts()`. Ignored if a context is given
+    """
+    if context is None:
+        context = GenerationContext(options)
+    records = pd.hoist_dataclasses(rs.dataclasses, context)
+    # render every field (and its loader) first, so we know what to import
+    for record in records:
+        for member in record.members:
+            render_line(member, context)
+            render_loader(member, context)
+
+    sink.write(context.get_import_stmts())
+    if rs.preamble:
+        sink.write('\n')
+        sink.write(rs.preamble)
+    emitter = pd.Emitter(sink)
+    for record in records:
+        sink.write('\n')
+        for level, line in _record_lines(record, context):
+            emitter.level = level
+            emitter.line(line)
+
+
+def generate_namedtuple_definitions(rs: ir.ResultSet, context: GenerationContext = None, options: Dict = None
+                                    ) -> str:
+    """Renders `rs` into the source code of a python module (see `write_namedtuple_definitions()`)"""
+    sink = StringIO()
+    write_namedtuple_definitions(rs, sink, context, options)
+    return sink.getvalue()
@@ -0,0 +1,131 @@
+"""Saving and loading the state of an inference run, so that schemas can be kept up to date incrementally.
+
+A checkpoint is a JSON document holding a flat list of ResultSet nodes (children are referenced by their index in the
+list, so there's no limit on how deeply the schema can be nested), along with the analysis options it was built with.
+Only JSON-native example values (str, int, float and bool) are kept in the saved samples"""
+import json
+import os
+from typing import Dict, Iterable, Tuple, Any
+
+from auto_class.analyze import ResultSet, Shape, get_opts, infer, HASHTABLE_DETECTORS, STRING_FORMATS
+
+CHECKPOINT_FORMAT = 'auto-class-checkpoint'
+CHECKPOINT_VERSION = 3
+
+_SAMPLE_TYPES = {'str', 'int', 'float', 'bool'}
+_SAVED_OPTIONS = ('threshold', 'detectors', 'key_sample', 'max_shapes', 'formats', 'max_distinct')
+
+
+def _encode(rs: ResultSet) -> list:
+    nodes = []
+    queue = [rs]
+
+    def ref(child: ResultSet) -> int:
+        if child is None:
+            return None
+        queue.append(child)
+        return len(queue) - 1
+
+    # `queue` grows as we go, so this visits every node breadth-first, and each node's index in `nodes` is its index
+    # in `queue`
+    for node in queue:
+        nodes.append({
+            'counts': node.counts,
+            'nulls': node.nulls,
+            'present': node.present,
+            'missing': node.missing,
+            'samples': {k: v for k, v in node.samples.items() if k in _SAMPLE_TYPES},
+            'formats': node.formats,
+            'distinct': sorted(node.distinct) if isinstance(node.distinct, set) else node.distinct,
+            'fields': [[k, ref(f)] for k, f in node.fields.items()] if node.fields is not None else None,
+            'items': ref(node.items),
+            'keys': ref(node.keys),
+            'values': ref(node.values),
+            'shapes': [[list(s.keys), s.count] for s in node.shapes.values()] if node.shapes is not None else None,
+        })
+    return nodes
+
+
+def _decode(nodes: list) -> ResultSet:
+    result_sets = [ResultSet() for _ in nodes]
+    for rs, node in zip(result_sets, nodes):
+        rs.counts = node['counts']
+        rs.nulls = node['nulls']
+        rs.present = node['present']
+        rs.missing = node['missing']
+        rs.samples = node['samples']
+        rs.formats = tuple(node['formats']) if node['formats'] is not None else None
+        rs.distinct = set(node['distinct']) if isinstance(node['distinct'], list) else node['distinct']
+        for slot in ('items', 'keys', 'values'):
+            if node[slot] is not None:
+                setattr(rs, slot, result_sets[node[slot]])
+        if node['fields'] is not None:
+            rs.fields = {k: result_sets[i] for k, i in node['fields']}
+        if node['shapes'] is not None:
+            rs.shapes = {}
+            for keys, count in node['shapes']:
+                shape = rs.shapes[tuple(keys)] = Shape(tuple(keys), [rs.fields[k] for k in keys])
+                shape.count = count
+    return result_sets[0]
+
+
+def save_checkpoint(rs: ResultSet, path: str, options: Dict = None):
+    """Saves `rs` (and the options used to build it) to a checkpoint file at `path`.
+    The file is written atomically, so a crash part way through never leaves a corrupt checkpoint behind"""
+    options = get_opts(options)
+    detectors = options['detectors']
+    if not all(isinstance(d, str) for d in detectors):
+        raise Exception('Only hash table detectors registered by name (see `analyze.register_detector()`) can be '
+                        'saved in a checkpoint')
+    document = {
+        'format': CHECKPOINT_FORMAT,
+        'version': CHECKPOINT_VERSION,
+        'options': {k: options[k] for k in _SAVED_OPTIONS},
+        'nodes': _encode(rs),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(document, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Tuple[ResultSet, Dict]:
+    """Loads a checkpoint saved by `save_checkpoint()`.
+
+    :return: the saved ResultSet, and the options it was built with
+    """
+    with open(path) as f:
+        document = json.load(f)
+    if document.get('format') != CHECKPOINT_FORMAT:
+        raise Exception(f'{path} is not an auto-class checkpoint')
+    if document.get('version') != CHECKPOINT_VERSION:
+        raise Exception(f'{path} is a version {document.get("version")} checkpoint. '
+                        f'Only version {CHECKPOINT_VERSION} checkpoints are supported')
+    options = document['options']
+    options['detectors'] = tuple(options['detectors'])
+    options['formats'] = tuple(options['formats'])
+    unknown = [d for d in options['detectors'] if d not in HASHTABLE_DETECTORS]
+    if unknown:
+        raise Exception(f'{path} was built with hash table detectors which have not been registered: {unknown}')
+    unknown = [f for f in options['formats'] if f not in STRING_FORMATS]
+    if unknown:
+        raise Exception(f'{path} was built with string formats which have not been registered: {unknown}')
+    return _decode(document['nodes']), options
+
+
+def infer_incremental(records: Iterable[Any], path: str, options: Dict = None) -> ResultSet:
+    """Folds `records` into the checkpoint at `path` (if there is one), saves the updated checkpoint, and returns the
+    updated ResultSet. The result is the same as running `infer()` over every record ever passed to this function
+    for this checkpoint, but only the new records have to be analyzed.
+
+    The options saved in the checkpoint are used by default, since changing them part way through would make the
+    result differ from a full re-run. Any `options` given here override them.
+    """
+    rs = None
+    if os.path.exists(path):
+        rs, saved_options = load_checkpoint(path)
+        options = {**saved_options, **(options or {})}
+    options = get_opts(options)
+    rs = infer(records, options, result=rs)
+    save_checkpoint(rs, path, options)
+    return rs
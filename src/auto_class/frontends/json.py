@@ -0,0 +1,249 @@
+import json
+import re
+from codecs import getincrementaldecoder
+from itertools import chain, islice
+from json.decoder import scanstring
+from typing import Iterable, Iterator, Dict, Any, Tuple, IO
+
+from auto_class import intermediate_representation as ir
+from auto_class import analyze
+
+CHUNK_SIZE = 64 * 1024
+
+_whitespace_re = re.compile(r'[ \t\n\r]*')
+_scalar_re = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?|true|false|null')
+_literals = {'true': True, 'false': False, 'null': None}
+_delimiters = set(' \t\n\r,:]}')
+_end = object()
+
+
+def iter_ndjson(lines: Iterable[str]) -> Iterator[Any]:
+    """Yields one decoded record per line of NDJSON (newline-delimited JSON). Blank lines are skipped.
+    `lines` can be anything which yields lines of text, like an open file or `sys.stdin`"""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def from_ndjson(lines: Iterable[str], name: str, options: Dict = None) -> ir.ResultSet:
+    """Infers a dataclass called `name` from a stream of NDJSON records, without ever holding more than one record in
+    memory at a time"""
+    t = analyze.infer(iter_ndjson(lines), options)
+    t = analyze.annotate(t, options)
+    return ir.ResultSet([analyze.to_ir(t, name)])
+
+
+def _read_chunks(fp: IO, chunk_size: int) -> Iterator[str]:
+    decoder = getincrementaldecoder('utf-8')()
+    while True:
+        chunk = fp.read(chunk_size)
+        text = decoder.decode(chunk, final=not chunk) if isinstance(chunk, bytes) else chunk
+        if text:
+            yield text
+        if not chunk:
+            return
+
+
+def iter_events(fp: IO, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """Tokenizes a JSON document incrementally, reading it `chunk_size` characters at a time from `fp` (a text or
+    binary file-like object), and yields parse events as (event, value) tuples:
+        ('start_map', None), ('map_key', key), ('end_map', None),
+        ('start_array', None), ('end_array', None),
+        ('value', scalar)
+    Only the current chunk (and any token which straddles the end of it) is ever held in memory"""
+    chunks = _read_chunks(fp, chunk_size)
+    buf, pos, eof = '', 0, False
+    containers = []
+    # what the grammar allows next: 'start' (the document's value, or nothing at all), 'value', 'first_value' (a value
+    # or the end of an array), 'key', 'first_key' (a key or the end of a map), 'colon', 'next' (a comma or the end of
+    # the enclosing container) or 'end' (only whitespace)
+    state = 'start'
+
+    while True:
+        pos = _whitespace_re.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                break
+            buf, pos = next(chunks, ''), 0
+            eof = not buf
+            continue
+
+        c = buf[pos]
+        if c == '{' or c == '[':
+            if state not in ('start', 'value', 'first_value'):
+                raise Exception(f'Unexpected "{c}" in JSON document')
+            containers.append(c)
+            state = 'first_key' if c == '{' else 'first_value'
+            yield ('start_map' if c == '{' else 'start_array'), None
+            pos += 1
+            continue
+        if c == '}' or c == ']':
+            if state not in ('next', 'first_key' if c == '}' else 'first_value') or \
+                    containers.pop() != ('{' if c == '}' else '['):
+                raise Exception(f'Unexpected "{c}" in JSON document')
+            state = 'next' if containers else 'end'
+            yield ('end_map' if c == '}' else 'end_array'), None
+            pos += 1
+            continue
+        if c == ',':
+            if state != 'next':
+                raise Exception('Unexpected "," in JSON document')
+            state = 'key' if containers[-1] == '{' else 'value'
+            pos += 1
+            continue
+        if c == ':':
+            if state != 'colon':
+                raise Exception('Unexpected ":" in JSON document')
+            state = 'value'
+            pos += 1
+            continue
+        if state in ('next', 'colon', 'end'):
+            raise Exception(f'Unexpected data in JSON document starting with "{buf[pos:pos + 20]}"')
+        if state in ('key', 'first_key') and c != '"':
+            raise Exception(f'Expected a key in JSON document, found "{buf[pos:pos + 20]}"')
+
+        # Anything else is a scalar, which may be cut off by the end of the buffer
+        end = None
+        if c == '"':
+            try:
+                value, end = scanstring(buf, pos + 1)
+            except ValueError:
+                if eof:
+                    raise
+        else:
+            m = _scalar_re.match(buf, pos)
+            # A token is only complete once we can see the delimiter after it (`-1500` might be the start of `-1500.5`)
+            if m and (buf[m.end():m.end() + 1] in _delimiters if m.end() < len(buf) else eof):
+                token, end = m.group(), m.end()
+                if token in _literals:
+                    value = _literals[token]
+                elif m.group(2) or m.group(3):
+                    value = float(token)
+                else:
+                    value = int(token)
+            elif eof:
+                raise Exception(f'Invalid JSON value starting with "{buf[pos:pos + 20]}"')
+        if end is None:
+            # We need more of the document to finish this token
+            chunk = next(chunks, '')
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        pos = end
+        if state in ('key', 'first_key'):
+            state = 'colon'
+            yield 'map_key', value
+        else:
+            state = 'next' if containers else 'end'
+            yield 'value', value
+
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+    if state not in ('start', 'end'):
+        raise Exception('Unexpected end of JSON document')
+
+
+def _build(event: str, value: Any, events: Iterator[Tuple[str, Any]]) -> Any:
+    """Builds the value which starts with (`event`, `value`) out of the following `events`"""
+    if event == 'value':
+        return value
+    root = {} if event == 'start_map' else []
+    stack = [root]
+    key = None
+    for event, value in events:
+        if event == 'map_key':
+            key = value
+            continue
+        if event == 'end_map' or event == 'end_array':
+            stack.pop()
+            if not stack:
+                return root
+            continue
+        if event == 'value':
+            item = value
+        else:
+            item = {} if event == 'start_map' else []
+        container = stack[-1]
+        if isinstance(container, dict):
+            container[key] = item
+        else:
+            container.append(item)
+        if event != 'value':
+            stack.append(item)
+    raise Exception('Unexpected end of JSON document')
+
+
+def _iter_array(events: Iterator[Tuple[str, Any]]) -> Iterator[Any]:
+    for event, value in events:
+        if event == 'end_array':
+            return
+        yield _build(event, value, events)
+
+
+def _iter_map(events: Iterator[Tuple[str, Any]]) -> Iterator[Tuple[Any, Any]]:
+    for event, key in events:
+        if event == 'end_map':
+            return
+        event, value = next(events)
+        yield key, _build(event, value, events)
+
+
+def infer_json(fp: IO, options: Dict = None, chunk_size: int = CHUNK_SIZE) -> analyze.ResultSet:
+    """Infers the structure of a single JSON document of any size, without ever loading the whole document.
+
+    If the document is an array, its elements are built and folded into the result one at a time (or sampled, see
+    `analyze.sample_records()`).
+    If it's a map, its first few entries are used to decide whether it's a hash table (see `analyze.is_hashtable()`).
+    If they look like one, its entries are built and folded into the result one at a time. Otherwise (a very large
+    record is unusual) it's built in full and folded like any other value.
+
+    The result is the same as `analyze.fold(ResultSet(), json.load(fp))`, except for a map whose first entries look
+    like a hash table but whose later keys don't (ie `group-0` to `group-19`, then `zzz`). `fold()` checks every key
+    and treats such a map as a record, but here the decision is made before the later keys have been read, so the
+    map is still folded as a hash table.
+    Malformed documents (including truncated ones) raise an exception
+    """
+    options = analyze.get_opts(options)
+    events = iter_events(fp, chunk_size)
+    rs = analyze.ResultSet()
+    try:
+        event, value = next(events)
+    except StopIteration:
+        raise Exception('JSON document is empty')
+
+    finished = True
+    if event == 'start_array':
+        items = _iter_array(events)
+        analyze.fold_list(rs, analyze.sample_records(items, options), options)
+        # sampling can stop reading the array early, in which case the rest of the document is never looked at
+        finished = next(items, _end) is _end
+    elif event == 'start_map':
+        pairs = _iter_map(events)
+        sample_size = max(options['key_sample'], options['threshold'])
+        sample = list(islice(pairs, sample_size))
+        if len(sample) == sample_size and analyze.is_hashtable(dict(sample), options['threshold'],
+                                                               options['detectors'], sample_size):
+            analyze.fold_hashtable(rs, chain(sample, pairs), options)
+        else:
+            d = dict(sample)
+            d.update(pairs)
+            analyze.fold(rs, d, options)
+    else:
+        analyze.fold(rs, value, options)
+    if finished:
+        # raises if there's anything but whitespace after the document
+        next(events, None)
+    return rs
+
+
+def from_json(fp: IO, name: str, options: Dict = None) -> ir.ResultSet:
+    """Infers a dataclass called `name` from a single (possibly huge) JSON document: either an array of records, or a
+    map of records keyed by id"""
+    rs = analyze.annotate(infer_json(fp, options), options)
+    if rs.fields is None and rs.values is not None:
+        # A hash table of records
+        rs = rs.values
+    return ir.ResultSet([analyze.to_ir(rs, name)])
@@ -22,6 +22,13 @@ class Sequence(Type):
     types: List[Type]
 
 
+@dataclass
+class Literal(Type):
+    """A scalar type (`name`) which only ever holds one of a few known `values`, like an enum. Backends which don't
+    know about literals can render it like any other scalar"""
+    values: List[Any]
+
+
 @dataclass(init=False)
 class HashTable(Type):
     name: str = field(default='dict', init=False)
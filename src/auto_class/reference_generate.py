@@ -2,14 +2,14 @@ from textwrap import dedent, indent
 from ast import literal_eval
 from os.path import commonprefix
 import re
-from typing import Optional
-from uuid import UUID
+from typing import Optional, Dict, Set, Tuple, FrozenSet, Iterable
 
 from ruamel.yaml import YAML
 from ruamel.yaml.comments import CommentedMap
 from jinja2 import Template
 
 from auto_class import intermediate_representation as ir
+from auto_class import analyze
 
 
 GENERATED_CLASSES = {}
@@ -18,6 +18,7 @@ EXTRA_CLASS_BODY = ''
 REQUIRED_TYPES: set = set()
 
 _tdre = re.compile(r'(\d+)$')
+REFERENCE_DETECTORS = ('common_prefix', 'numeric_suffix', 'uuids')
 _uuid4hex = re.compile('[0-9a-f]{32}\Z', re.I)
 
 
@@ -33,50 +34,20 @@ def is_hashtable(d: dict):
     """makes an educated guess about whether or not this given dictionary is a hash table
     (a keyed list where all the values are the same type).
 
-    It does this by first determining if all keys have a common prefix, and then checking if all values are the
-    same type"""
-
-    def has_common_prefix(d: dict) -> bool:
-        prefix = commonprefix(list(d.keys()))
-        if len(prefix) > 0:
-            return True
-        return False
+    It does this by first determining if all keys have a common prefix (or numeric suffixes, or are all UUIDs), and
+    then checking if all values are the same type. Key checks are done with the sampling, early-exit detectors from
+    `auto_class.analyze`"""
 
     def all_values_are_the_same(d: dict) -> bool:
-        test_val = next(iter(d.values()))
-        if all(isinstance(x, type(test_val)) for x in iter(d.values())):
-            return True
-        else:
-            return False
-
-    def all_keys_are_sequential(d: dict) -> bool:
-        """`has_common_prefix() catches most instances of this, but sometimes hash tables have sets of keys like:
-        {'00', '01', '02', ...}. This function identifies those"""
-        key_digits = [get_trailing_digits(k) for k in d.keys()]
-        if all([k is not None for k in key_digits]):
-            return True
-        return False
-
-    def all_keys_are_uuids(d: dict) -> bool:
-        try:
-            for k in d:
-                UUID(k)
-        except ValueError:
-            return False
-        else:
-            return True
+        values = iter(d.values())
+        test_type = type(next(values))
+        return all(isinstance(x, test_type) for x in values)
 
     if len(d.keys()) < 2:
         # if a dict only has one key, it's safe to assume it's a dataclass
         return False
 
-    if has_common_prefix(d) and all_values_are_the_same(d):
-        return True
-
-    if all_keys_are_sequential(d) and all_values_are_the_same(d):
-        return True
-
-    if all_keys_are_uuids(d) and all_values_are_the_same(d):
+    if analyze.is_hashtable(d, threshold=2, detectors=REFERENCE_DETECTORS) and all_values_are_the_same(d):
         return True
 
     return False
@@ -93,28 +64,50 @@ def get_type_name(t):
         return typename
 
 
+class NameAllocator:
+    """Hands out unique class names. If the name asked for is taken, a number is added to the end of it (`Item`,
+    `Item1`, `Item2`, ...), or the number it already ends with is incremented.
+    Asking for a name again with the same members gives back the name those members got the first time.
+
+    Both are O(1): numbers come from a counter per base name (the name without its number), instead of trying every
+    candidate name in turn, and classes are found in an index of (name asked for, members) -> name"""
+
+    def __init__(self):
+        self.taken: Set[str] = set()
+        self.counters: Dict[str, int] = {}  # base name -> the highest number given out with it
+        self.shapes: Dict[Tuple[str, FrozenSet[str]], str] = {}
+
+    def allocate(self, cls_name: str, members: Iterable[str]) -> Tuple[str, bool]:
+        """returns a unique name for a class called `cls_name` with `members`, and whether a class with that name and
+        those members already exists"""
+        members = frozenset(members)
+        name = self.shapes.get((cls_name, members))
+        if name is not None:
+            return name, True
+
+        name = cls_name
+        if name in self.taken:
+            num = get_trailing_digits(cls_name)
+            base = cls_name[:-len(str(num))] if num else cls_name
+            num = max(num or 0, self.counters.get(base, 0))
+            while name in self.taken:
+                num += 1
+                name = f"{base}{num}"
+            self.counters[base] = num
+        self.taken.add(name)
+        # the class can be found by the name it got, as well as the name it asked for
+        self.shapes[(cls_name, members)] = self.shapes[(name, members)] = name
+        return name, False
+
+
+CLASS_NAMES = NameAllocator()
+
+
 def get_class_name(cls_name, members):
-    global GENERATED_CLASSES
     # at this point, we need to create a new class with a name that may already exist.
     # If the existing name doesn't have a number on the end of it, we wanna add a number to the end of it.
     # If it already has a number on the end of it, we wanna increment that number
-    if cls_name in GENERATED_CLASSES and set(members) == GENERATED_CLASSES[cls_name]['members']:
-        already_exists = True
-        return cls_name, already_exists
-
-    if cls_name not in GENERATED_CLASSES:
-        already_exists = False
-        return cls_name, already_exists
-
-    cls_num = get_trailing_digits(cls_name)
-    if cls_num:
-        end_point = len(str(cls_num))
-        cls_num += 1
-        cls_name = cls_name[:-end_point] + str(cls_num)
-    else:
-        cls_name += '1'
-
-    return get_class_name(cls_name, members)
+    return CLASS_NAMES.allocate(cls_name, members)
 
 
 def handle_tuple(t, name, comment):
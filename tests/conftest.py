@@ -146,4 +146,30 @@ class irTestData:
 
 @pytest.fixture(scope='session')
 def ir_test_data():
-    return irTestData
\ No newline at end of file
+    return irTestData
+
+
+@pytest.fixture
+def order_ir():
+    """A record using most of the IR: nested classes (one of them used twice), a sequence of classes, hash tables,
+    unions, defaults, optional members and keys which aren't identifiers. Built fresh for every test, so no test sees
+    IR another one has changed (see `py_dataclass_test_data`)"""
+    def address():
+        return DataClass('Address', [Member('street', [Type('str')]),
+                                     Member('Postal Code', [Type('str'), Type('None')], optional=True)])
+
+    item = DataClass('Items', [Member('sku', [Type('UUID')]),
+                               Member('quantity', [Type('int')], default=1),
+                               Member('tags', [Sequence('list', [Type('str')])], optional=True)])
+    return DataClass('Order', [
+        Member('id', [Type('int')]),
+        Member('created-at', [Type('datetime')]),
+        Member('note', [Type('str'), Type('None')]),
+        Member('status', [Type('str')], default='new'),
+        Member('shipping', [address()]),
+        Member('billing', [address(), Type('None')], optional=True),
+        Member('items', [Sequence('list', [item])]),
+        Member('totals', [HashTable(key=Type('str'), values=[Type('int'), Type('float')])]),
+        Member('history', [HashTable(key=Type('str'), values=[Sequence('list', [Type('date')])])], optional=True),
+        Member('ref', [Type('str'), Type('UUID')], optional=True),
+    ])
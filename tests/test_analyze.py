@@ -0,0 +1,396 @@
+from concurrent.futures import Future
+from copy import deepcopy
+from io import StringIO
+import json
+import threading
+from types import SimpleNamespace
+from uuid import uuid4
+
+from auto_class import analyze, checkpoint
+from auto_class import intermediate_representation as ir
+from auto_class.backends import py_dataclass as pd
+from auto_class.frontends.json import from_ndjson
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def records():
+    return [
+        {'id': 1, 'name': 'one', 'tags': ['a', 'b'], 'owner': {'id': 1, 'email': 'a@b.c'}},
+        {'id': 2, 'name': None, 'tags': [], 'owner': {'id': 2, 'email': None, 'admin': True}},
+        {'id': '3', 'name': 'three', 'tags': ['c', 4], 'owner': None, 'extra': 1.5},
+    ]
+
+
+def test_infer_matches_reduce(records):
+    expected = analyze.annotate(analyze.reduce(analyze.convert_hash_tables(deepcopy(records), {}), {}), {})[0]
+    result = analyze.annotate(analyze.infer(iter(records)), {}).fields
+
+    assert result.keys() == expected.keys()
+    for key in expected:
+        assert (result[key].types, result[key].type, result[key].optional) == \
+               (expected[key].types, expected[key].type, expected[key].optional)
+
+
+def test_infer_memory_is_bounded_by_schema(records):
+    rs = analyze.infer(deepcopy(records[i % 3]) for i in range(3000))
+    assert rs.counts == {'dict': 3000}
+    assert rs.fields['id'].counts == {'int': 2000, 'str': 1000}
+    assert rs.fields['id'].samples == {'int': [1, 2], 'str': ['3']}
+    assert rs.fields['tags'].items.counts == {'str': 3000, 'int': 1000}
+    assert rs.fields['owner'].fields['email'].samples == {'str': ['a@b.c']}
+
+
+def test_result_set_tells_missing_from_null(records):
+    rs = analyze.infer(records)
+    name, extra, admin = rs.fields['name'], rs.fields['extra'], rs.fields['owner'].fields['admin']
+
+    assert (name.present, name.nulls, name.missing) == (3, 1, 0)
+    assert (extra.present, extra.nulls, extra.missing) == (1, 0, 2)
+    assert (admin.present, admin.nulls, admin.missing) == (1, 0, 1)
+    assert rs.fields['owner'].nulls == 1
+
+
+def test_result_set_samples_are_bounded():
+    rs = analyze.infer({'n': n % 100, 's': str(n)} for n in range(1000, 0, -1))
+    assert rs.fields['n'].samples['int'] == list(range(analyze.SAMPLE_SIZE))
+    assert len(rs.fields['s'].samples['str']) == analyze.SAMPLE_SIZE
+
+
+def test_from_ndjson(records):
+    lines = StringIO('\n'.join(json.dumps(r) for r in records) + '\n\n')
+    rs = from_ndjson(lines, 'api_record')
+    result = pd.generate_dataclass_definitions(rs)
+
+    print(result)
+    assert 'class ApiRecord:' in result
+    assert 'class Owner:' in result
+    # the only string id is '3', which is an int in a string
+    assert "    id: int = field(default_factory=int)" in result
+    assert "    name: Optional[str] = None" in result
+    assert "    owner: Optional[Owner] = None" in result
+    assert "        admin: bool = field(default_factory=bool, metadata=dict(default=bool, missing=bool, " \
+           "required=False))" in result
+
+
+def test_merge_is_associative_and_commutative(records):
+    chunks = [records[:1], records[1:2], records[2:]]
+    p1, p2, p3 = [analyze.PartialSchema(i, i + 1, analyze.infer(c)) for i, c in enumerate(chunks)]
+    expected = analyze.infer(records)
+
+    assert p1.merge(p2).merge(p3).result == expected
+    assert p1.merge(p2.merge(p3)).result == expected
+    assert p3.merge(p2).merge(p1).result == expected
+    assert p2.merge(p1).merge(p3).result == expected
+    assert list(expected.fields) == ['id', 'name', 'tags', 'owner', 'extra']
+
+
+def test_infer_parallel(records):
+    data = [deepcopy(records[i % 3]) for i in range(300)]
+    data[150]['late_key'] = 'only here'
+
+    result = analyze.infer_parallel(iter(data), workers=2, chunk_size=7)
+
+    assert result == analyze.infer(data)
+    assert result.fields['late_key'].missing == 299
+
+
+def test_infer_parallel_holds_back_while_a_chunk_is_slow(records, monkeypatch):
+    class Pool:
+        """runs every chunk straight away, except the first one, which finishes a little while later"""
+        def __init__(self, max_workers):
+            assert max_workers == 2
+            self.submitted_while_slow = 0
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def submit(self, fn, *args):
+            future = Future()
+            if not pool.first:
+                pool.first = future
+                threading.Timer(0.2, lambda: future.set_result(fn(*args))).start()
+            else:
+                if not pool.first.done():
+                    self.submitted_while_slow += 1
+                future.set_result(fn(*args))
+            return future
+
+    def make_pool(max_workers):
+        pool.instance = Pool(max_workers)
+        return pool.instance
+
+    pool = SimpleNamespace(first=None, instance=None)
+    monkeypatch.setattr(analyze, 'ProcessPoolExecutor', make_pool)
+    monkeypatch.setattr(analyze.os, 'cpu_count', lambda: 2)
+    data = [deepcopy(records[i % 3]) for i in range(300)]
+
+    assert analyze.infer_parallel(iter(data), chunk_size=7) == analyze.infer(data)
+    # `workers * 2` chunks at a time: the slow one, and 3 more which have to wait for it before they can be merged
+    assert pool.instance.submitted_while_slow == 3
+
+
+def test_analyze_matches_three_pass_analysis(records):
+    expected = analyze.annotate(analyze.reduce(analyze.convert_hash_tables(deepcopy(records), {}), {}), {})[0]
+    result = analyze.analyze(records)
+
+    assert result.counts == {'list': 1}
+    assert result.items.fields.keys() == expected.keys()
+    for key in expected:
+        assert (result.items.fields[key].types, result.items.fields[key].type, result.items.fields[key].optional) == \
+               (expected[key].types, expected[key].type, expected[key].optional)
+    assert analyze.to_ir(result, 'Record') == analyze.to_ir(analyze.infer(records), 'Record')
+
+
+def test_analyze_deeply_nested_data():
+    depth = 20000
+    data = 'bottom'
+    for i in range(depth):
+        data = {'child': data} if i % 2 else [data]
+
+    rs = analyze.analyze(data)
+    assert rs == analyze.analyze(data)
+    merged = analyze.merge(rs, analyze.analyze(data))
+    assert merged != rs
+    result = rs
+
+    levels = 0
+    while rs.type != 'str':
+        rs = rs.fields['child'] if rs.type == 'dict' else rs.items
+        merged = merged.fields['child'] if merged.fields else merged.items
+        levels += 1
+    assert levels == depth
+    assert rs.samples == {'str': ['bottom']}
+    assert merged.counts == {'str': 2}
+
+    node = analyze.to_ir(result, 'Root')
+    levels = 0
+    while not isinstance(node, ir.Type) or node.name != 'str':
+        node = node.members[0].types[0] if isinstance(node, ir.DataClass) else node.types[0]
+        levels += 1
+    assert levels == depth
+
+
+def test_analyze_never_modifies_its_input(records):
+    data = {
+        'records': records,
+        'groups': {f'group-{i}': {'id': i, 'members': [{'name': 'a'}, {'name': 'b', 'admin': True}]} for i in range(20)}
+    }
+    original = deepcopy(data)
+    groups = data['groups']
+
+    rs = analyze.analyze(data)
+
+    assert data == original
+    assert data['groups'] is groups
+    assert rs.fields['groups'].counts == {'HashTable': 1}
+    assert rs.fields['groups'].values.fields['members'].items.fields['admin'].missing == 20
+
+
+def test_hashtable_is_a_view():
+    d = {f'group-{i}': i for i in range(20)}
+    table = analyze.HashTable(d)
+    assert table.source is d
+    assert list(table.keys) == list(d) and list(table) == list(d.values()) and len(table) == 20
+    assert isinstance(analyze.convert_hash_tables({'groups': d}, {})['groups'], analyze.HashTable)
+
+
+@pytest.mark.parametrize('keys', [
+    [f'group-{i}' for i in range(50)],
+    [f'{i:02d}' for i in range(50)],
+    list(range(50)),
+    ['{%032x}' % (i * 7919) for i in range(50)],
+    ['%08x-0000-4000-8000-%012x' % (i, i) for i in range(50)],
+])
+def test_is_hashtable(keys):
+    assert analyze.is_hashtable(dict.fromkeys(keys, 1))
+    assert not analyze.is_hashtable(dict.fromkeys(keys[:5], 1))
+
+
+def test_is_hashtable_exits_early():
+    checked = []
+
+    @analyze.register_detector('counting')
+    def counting(keys):
+        for k in keys:
+            checked.append(k)
+            if not k.startswith('field'):
+                return False
+        return True
+
+    record = {f'field_{i}_x' if i < 5 else f'attribute_{i}_x': i for i in range(100_000)}
+    assert not analyze.is_hashtable(record, detectors=analyze.DEFAULT_DETECTORS + ('counting',))
+    assert len(checked) == 6
+
+    checked.clear()
+    analyze.is_hashtable(record)
+    assert not checked
+
+
+def test_custom_detectors():
+    macs = {':'.join('%02x' % (i * p % 256) for p in (37, 59, 71, 89, 101, 113)): {'ip': f'10.0.0.{i}'}
+            for i in range(1, 21)}
+    analyze.register_detector('mac_addresses', lambda keys: all(k.count(':') == 5 for k in keys))
+
+    assert analyze.analyze({'hosts': macs}).fields['hosts'].counts == {'dict': 1}
+    options = {'detectors': analyze.DEFAULT_DETECTORS + ('mac_addresses',)}
+    assert analyze.analyze({'hosts': macs}, options).fields['hosts'].counts == {'HashTable': 1}
+
+
+def test_shape_interning(records):
+    data = [deepcopy(records[i % 3]) for i in range(30)]
+    rs = analyze.infer(data)
+    unshaped = analyze.infer(data, {'max_shapes': 0})
+
+    assert analyze.to_ir(rs, 'Record') == analyze.to_ir(unshaped, 'Record')
+    assert not unshaped.shapes
+    assert analyze.shape_frequencies(rs) == {
+        '': {('id', 'name', 'tags', 'owner'): 20, ('id', 'name', 'tags', 'owner', 'extra'): 10},
+        'owner': {('id', 'email'): 10, ('id', 'email', 'admin'): 10},
+    }
+    assert rs.fields['extra'].missing == 20
+    assert rs.fields['owner'].fields['admin'].missing == 10
+
+
+def test_incremental_inference_with_checkpoints(records, tmp_path):
+    path = str(tmp_path / 'schema.checkpoint')
+    data = [deepcopy(records[i % 3]) for i in range(30)]
+    data[20]['owner'] = {'id': 3, 'email': 'x@y.z', 'groups': {f'group-{i}': {'id': i} for i in range(12)}}
+
+    checkpoint.infer_incremental(data[:10], path)
+    checkpoint.infer_incremental(data[10:25], path)
+    result = checkpoint.infer_incremental(iter(data[25:]), path)
+
+    assert result == analyze.infer(data)
+    assert checkpoint.load_checkpoint(path)[0] == result
+
+
+def test_checkpoint_version_is_checked(tmp_path):
+    path = tmp_path / 'schema.checkpoint'
+    path.write_text('{"format": "auto-class-checkpoint", "version": 0, "nodes": []}')
+    with pytest.raises(Exception, match='version 0'):
+        checkpoint.load_checkpoint(str(path))
+
+
+def test_sampling(records):
+    data = [dict(deepcopy(records[i % 2]), id=i) for i in range(1000)]
+    data[700]['owner'] = {'id': 3, 'email': 'x@y.z', 'groups': ['admins']}
+
+    sampled = analyze.infer(data, {'sample_size': 50, 'seed': 1})
+    assert sampled.present == 50
+    assert sampled == analyze.infer(data, {'sample_size': 50, 'seed': 1})
+
+    stratified = analyze.infer(data, {'sample_size': 50, 'per_shape': 1})
+    assert stratified.fields['owner'].fields['groups'].present == 1
+    assert 50 < stratified.present < 60
+
+    stopped = analyze.infer(iter(data), {'patience': 100})
+    assert stopped.present == 102
+    assert 'groups' not in stopped.fields['owner'].fields
+
+    report = analyze.coverage(stratified)
+    assert report['owner.groups']['seen'] == 1
+    assert report['owner.groups']['ratio'] == 1 / stratified.fields['owner'].counts['dict']
+    assert report['owner.groups[]']['types'] == {'str': 1}
+
+
+def test_string_formats():
+    data = [{'id': str(i), 'created': f'2019-01-{i % 28 + 1:02}T12:00:00Z', 'day': '2019-01-31', 'key': str(uuid4()),
+             'name': f'user {i}'} for i in range(3000)]
+    data[2500]['id'] = '25OO'
+
+    options = {'formats': analyze.BUILTIN_FORMATS}
+    rs = analyze.infer(data, options)
+    assert rs.fields['created'].formats == ('datetime',)
+    assert rs.fields['day'].formats == ('date',)
+    assert rs.fields['key'].formats == ('uuid',)
+    assert rs.fields['id'].formats == ()
+    assert rs.fields['name'].formats == ()
+    assert [m.types for m in analyze.to_ir(rs, 'Record').members] == [
+        [ir.Type('str')], [ir.Type('datetime')], [ir.Type('date')], [ir.Type('UUID')], [ir.Type('str')]]
+
+    assert analyze.infer(data[:2000], options).fields['id'].formats == ('int',)
+    assert analyze.merge(analyze.infer(data[:2000], options), analyze.infer(data[2000:], options)) == rs
+    assert analyze.analyze(data, options).items.fields['created'].formats == ('datetime',)
+    # formats are only checked when they're asked for, since they change what the generated classes dump
+    default = analyze.infer(data[:2000])
+    assert default.fields['created'].formats is None and default.fields['id'].formats is None
+    assert [m.types for m in analyze.to_ir(default, 'Record').members] == [[ir.Type('str')]] * 5
+
+
+@pytest.mark.parametrize('column, expected', [
+    (['0', '7', '42', '1234567890123'], True),
+    (['42', '02134'], False),  # a zip code
+    (['42', '+15551234567'], False),
+    (['-5'], False),
+    (['00'], False),
+    (['١٢'], False),  # arabic-indic digits
+    ([''], False),
+])
+def test_int_format_is_lossless(column, expected):
+    assert analyze.all_strings_are_ints(column) is expected
+
+
+@pytest.mark.parametrize('check, column', [
+    (analyze.all_strings_are_dates, ['2019-01-31', '2019-02-30']),
+    (analyze.all_strings_are_dates, ['1234-56-78']),  # a serial number
+    (analyze.all_strings_are_datetimes, ['2019-01-31T12:00:00Z', '2019-13-45T99:99:99Z']),
+    (analyze.all_strings_are_datetimes, ['2019-02-29 12:00']),
+])
+def test_date_formats_need_real_dates(check, column):
+    assert check(column) is False
+    assert check(column[:1]) is (len(column) > 1)
+
+    data = [{'value': s} for s in column]
+    rs = analyze.infer(data, {'formats': ('datetime', 'date')})
+    assert analyze.to_ir(rs, 'Record').members[0].types == [ir.Type('str')]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2019-01-31T12:00:00Z', True),
+    ('2019-01-31 12:00', True),
+    ('2019-01-31T12:00:00.123+05:30', True),
+    ('2019-01-31T12:00:00.123456-05:00', True),
+    ('2019-01-31T12:00:00+0000', False),
+    ('2019-01-31T12:00:00.1Z', False),
+    ('2019-01-31T12:00:00.1234567Z', False),
+])
+def test_datetime_format_loads_on_every_version(value, expected):
+    """only timestamps `from_dict()` can load on python 3.7+, the way the Schema loads them, are datetimes"""
+    assert analyze.all_strings_are_datetimes([value]) is expected
+    rs = analyze.infer([{'t': value}], {'formats': ('datetime',)})
+    record = analyze.to_ir(rs, 'Record')
+    assert record.members[0].types == [ir.Type('datetime' if expected else 'str')]
+
+    module = {}
+    exec(pd.generate_dataclass_definitions(ir.ResultSet([record]), options={'fast_io': True}), module)
+    cls = module['Record']
+    assert cls.from_dict({'t': value}) == cls.Schema().load({'t': value})
+
+
+def test_low_cardinality_strings(tmp_path):
+    data = [{'id': i, 'status': ['open', 'closed', 'pending'][i % 3], 'name': f'user {i}', 'day': '2019-01-31',
+             'region': ['us', 'eu', None][i % 3]} for i in range(300)]
+    options = {'max_distinct': 4, 'formats': ('date',)}
+
+    rs = analyze.infer(data, options)
+    assert rs.fields['status'].distinct == {'open', 'closed', 'pending'}
+    assert rs.fields['name'].distinct is False
+    assert analyze.infer(data).fields['status'].distinct is None
+    assert [m.types for m in analyze.to_ir(rs, 'Record').members] == [
+        [ir.Type('int')], [ir.Literal('str', values=['closed', 'open', 'pending'])], [ir.Type('str')],
+        [ir.Type('date')], [ir.Literal('str', values=['eu', 'us']), ir.Type('None')]]
+    # a handful of values, each seen once, isn't an enum
+    assert analyze.to_ir(analyze.infer(data[:3], options), 'Record').members[1].types == [ir.Type('str')]
+
+    assert analyze.merge(analyze.infer(data[:100], options), analyze.infer(data[100:], options), 4) == rs
+    few, many = [{'name': f'user {i % 3}'} for i in range(30)], [{'name': f'user {i}'} for i in range(3, 6)]
+    assert analyze.merge(analyze.infer(few, options), analyze.infer(many, options), 4).fields['name'].distinct is False
+
+    path = str(tmp_path / 'schema.checkpoint')
+    checkpoint.infer_incremental(data[:100], path, options)
+    assert checkpoint.infer_incremental(data[100:], path) == rs
@@ -0,0 +1,69 @@
+from io import StringIO, BytesIO
+import json
+
+from auto_class import analyze
+from auto_class.backends import py_dataclass as pd
+from auto_class.frontends.json import iter_events, infer_json, from_json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def document():
+    return [
+        {'id': 1, 'name': 'café \\"quoted\\"', 'score': -1.5e3, 'tags': ['a', 'b'], 'active': True},
+        {'id': 22, 'name': None, 'score': 0, 'tags': [], 'owner': {'email': 'a@b.c', 'groups': [{'id': 1}]}},
+        {'id': 333, 'name': '☃', 'score': 12.25, 'tags': [False, None], 'active': False, 'empty': {}},
+    ]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 4096])
+def test_iter_events_matches_json_load(document, chunk_size):
+    text = json.dumps(document, indent=2, ensure_ascii=False)
+    events = list(iter_events(StringIO(text), chunk_size))
+    assert events[:4] == [('start_array', None), ('start_map', None), ('map_key', 'id'), ('value', 1)]
+    assert events[-1] == ('end_array', None)
+    assert sum(1 for e, _ in events if e == 'start_map') == 6
+
+    binary = list(iter_events(BytesIO(text.encode('utf-8')), chunk_size))
+    assert binary == events
+
+
+@pytest.mark.parametrize('text', ['[1 2]', '[1,,2]', '[1,]', '[,1]', '{"a" 1}', '{"a":}', '{"a": 1 "b": 2}',
+                                  '{"a": 1,}', '{1: 2}', '{"a"}', '{"a": 1]', '[1}', '[1] [2]', '1 2', '{"a": 1}}', '[1', '{"a":',
+                                  '"a" :', ']', ':'])
+@pytest.mark.parametrize('chunk_size', [1, 4096])
+def test_iter_events_rejects_malformed_documents(text, chunk_size):
+    with pytest.raises(Exception):
+        list(iter_events(StringIO(text), chunk_size))
+    with pytest.raises(Exception):
+        infer_json(StringIO(text), chunk_size=chunk_size)
+
+
+def test_infer_json_rejects_malformed_documents():
+    with pytest.raises(Exception, match='Unexpected ","'):
+        infer_json(StringIO('{"a":, "b": {"c": 1}, "d": 2}'))
+    assert list(iter_events(StringIO(' '))) == []
+
+
+@pytest.mark.parametrize('chunk_size', [5, 4096])
+def test_infer_json_streams_arrays(document, chunk_size):
+    result = infer_json(StringIO(json.dumps(document)), chunk_size=chunk_size)
+    assert result == analyze.fold(analyze.ResultSet(), document)
+
+
+def test_infer_json_streams_hashtables(document):
+    table = {f'record-{i}': document[i % 3] for i in range(100)}
+    result = infer_json(StringIO(json.dumps(table)), chunk_size=64)
+    assert result.counts == {'HashTable': 1}
+    assert result == analyze.fold(analyze.ResultSet(), table)
+
+    small = {'a': 1, 'b': [1, 2]}
+    assert infer_json(StringIO(json.dumps(small))) == analyze.fold(analyze.ResultSet(), small)
+
+
+def test_from_json(document):
+    table = {f'record-{i}': document[i % 3] for i in range(100)}
+    result = pd.generate_dataclass_definitions(from_json(StringIO(json.dumps(table)), 'Record'))
+    assert 'class Record:' in result
+    assert '    id: int = field(default_factory=int)' in result
@@ -1,6 +1,12 @@
+from auto_class import analyze
 from auto_class.backends import py_dataclass as pd
+from auto_class import intermediate_representation as ir
 from auto_class.intermediate_representation import ResultSet
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 from textwrap import dedent
+import sys
+from uuid import uuid4
 
 import pytest
 
@@ -285,7 +291,7 @@ def test_generate_module_code(py_dataclass_test_data):
     print(f"Data in: \n\t{dataclass}\nResult:\n\t{result}\n")
 
     expected_output = """
-from typing import Type, Union, List, Any, Tuple, Optional, Set, Dict, ClassVar
+from typing import Any, ClassVar, Dict, List, Optional, Type, Union
 from dataclasses import field
 from marshmallow import Schema
 from marshmallow_dataclass import dataclass
@@ -303,3 +309,346 @@ from marshmallow.fields import Email
                 assert type in generated_line
         else:
             assert generated_line == expected_line
+
+
+def test_render_cache():
+    def address():
+        return ir.DataClass('Address', [ir.Member('street', [ir.Type('str')]), ir.Member('city', [ir.Type('str')])])
+
+    record = ir.DataClass('Record', [ir.Member(f'address {i}', [address()]) for i in range(50)])
+    uncached = pd.from_ir(record).definition
+
+    context = pd.GenerationContext()
+    cache = context.cache
+    assert pd.render_definition(record, context) == uncached
+    assert pd.render_definition(record, context) == uncached
+
+    # every copy of the nested Address class has the same members, so they're only rendered once
+    assert len({cache.structure_id(m.types[0]) for m in record.members}) == 1
+    assert [what for what, _ in cache.renders].count('render_line') == 50 + 2
+
+
+def test_concurrent_generation(ir_test_data):
+    def manifest(i):
+        # every other manifest needs a different set of imports
+        if i % 2:
+            extra = ir.Member('when', [ir.Type('datetime')])
+        else:
+            extra = ir.Member('ids', [ir.Sequence('set', [ir.Type('int')])], optional=True)
+        template = ir_test_data.dataclasses[i % len(ir_test_data.dataclasses)]
+        return ResultSet([ir.DataClass(f'Record{i}', template.members + [extra])])
+
+    manifests = [manifest(i) for i in range(400)]
+    serial = [pd.generate_dataclass_definitions(m) for m in manifests]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        concurrent = list(pool.map(pd.generate_dataclass_definitions, manifests))
+
+    assert concurrent == serial
+    # nothing leaks from one generation run into the next
+    assert 'datetime' not in serial[0] and 'datetime' in serial[1]
+    assert 'Set' not in serial[1].splitlines()[1]
+
+
+def test_streaming_deeply_nested_classes():
+    depth = 2000
+    dc = ir.DataClass('Leaf', [ir.Member('value', [ir.Type('int')])])
+    for i in range(depth):
+        dc = ir.DataClass(f'Level{i}', [ir.Member('child', [dc])])
+
+    sink = StringIO()
+    pd.write_dataclass_definitions(ResultSet([dc]), sink)
+    result = sink.getvalue()
+
+    assert result == pd.generate_dataclass_definitions(ResultSet([dc]))
+    assert f"{' ' * 4 * (depth + 1)}value: int = field(default_factory=int)\n" in result
+    assert f"\n{' ' * 4 * depth}class Leaf:\n" in result
+    assert result.endswith("    child: Level1998 = field(default_factory=Level1998)\n"
+                           "    Schema: ClassVar[Type[Schema]] = Schema\n")
+
+
+def test_hoisting_identical_classes():
+    def address(*extra):
+        return ir.DataClass('Address', [ir.Member('street', [ir.Type('str')])] + list(extra))
+
+    def person(name):
+        return ir.DataClass(name, [ir.Member('name', [ir.Type('str')]), ir.Member('address', [address()])])
+
+    record = ir.DataClass('Record', [
+        ir.Member('owner', [person('Owner')]),
+        ir.Member('admins', [ir.Sequence('list', [person('Admins')])]),
+        ir.Member('address', [address()]),
+        ir.Member('shipping', [ir.Type('None'), ir.DataClass('Shipping', [
+            ir.Member('address', [address(ir.Member('country', [ir.Type('str')]))]),
+        ])]),
+    ])
+    result = pd.generate_dataclass_definitions(ResultSet([record]), options={'hoist': True})
+    print(result)
+
+    assert result.count('class Address:') == 1
+    # a different class which happens to have the same name
+    assert result.count('class Address1:') == 1
+    assert "    address: Address1 = field(default_factory=Address1)" in result
+    assert result.count('@dataclass') == 6
+    # nothing is nested, and everything is defined before it's used
+    assert '    @dataclass' not in result
+    assert result.index('class Address:') < result.index('class Owner:') < result.index('class Record:')
+
+    module = {}
+    exec(result, module)
+    loaded = module['Record'].Schema().load({
+        'owner': {'name': 'a', 'address': {'street': 'b'}}, 'admins': [{'name': 'c', 'address': {'street': 'd'}}],
+        'address': {'street': 'e'}, 'shipping': {'address': {'street': 'f', 'country': 'g'}},
+    })
+    assert type(loaded.owner.address) is type(loaded.admins[0].address) is module['Address']
+    assert loaded.shipping.address.country == 'g'
+
+
+def test_slots():
+    record = ir.DataClass('Record', [
+        ir.Member('name', [ir.Type('str')]),
+        ir.Member('owner', [ir.DataClass('Owner', [ir.Member('name', [ir.Type('str')])])]),
+        ir.Member('admins', [ir.Sequence('list', [ir.DataClass('Admins', [ir.Member('name', [ir.Type('str')])])])]),
+    ])
+    result = pd.generate_dataclass_definitions(ResultSet([record]), options={'slots': True})
+    print(result)
+    assert 'from marshmallow_dataclass import dataclass' not in result
+    # run the generated module both with dataclass(slots=True) and with the fallback for older pythons
+    fallback = result.replace('sys.version_info >= (3, 10)', 'False')
+    assert fallback != result
+    data = {'name': 'a', 'owner': {'name': 'b'}, 'admins': [{'name': 'c'}]}
+    for source in (result, fallback):
+        module = {}
+        exec(source, module)
+        schema = module['Record'].Schema()
+        loaded = schema.load(data)
+        for instance in (loaded, loaded.owner, loaded.admins[0]):
+            assert not hasattr(instance, '__dict__')
+        assert type(loaded.owner) is module['Record'].Owner
+        assert schema.dump(loaded) == data
+        assert module['Record']().admins == []
+
+
+def test_fast_io(order_ir):
+    data = {'id': '12', 'created-at': '2020-01-02T03:04:05Z', 'note': None,
+            'shipping': {'street': 'a', 'Postal Code': 'H0H 0H0'}, 'billing': {'street': 'b'},
+            'items': [{'sku': str(uuid4()), 'quantity': 3, 'tags': ['x']}, {'sku': str(uuid4())}],
+            'totals': {'a': 1, 'b': 2}, 'history': {'x': ['2020-01-01']}, 'ref': str(uuid4())}
+    for options in ({}, {'hoist': True}, {'slots': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([order_ir]), options=dict(options, fast_io=True))
+        print(result)
+        module = {}
+        exec(result, module)
+        cls = module['Order']
+        loaded = cls.from_dict(data)
+        assert loaded == cls.Schema().load(data)
+        assert loaded.to_dict() == cls.Schema().dump(loaded)
+        address_cls = type(loaded.shipping)
+        assert address_cls.from_dict({}) == address_cls.Schema().load({})
+        # floats in a union of int and float are kept, where the Schema truncates them
+        fractional = dict(data, totals={'a': 1, 'b': 2.5})
+        assert cls.from_dict(fractional).totals == {'a': 1, 'b': 2.5}
+        assert cls.Schema().load(fractional).totals == {'a': 1, 'b': 2}
+        assert cls.from_dict(fractional).to_dict() == cls.Schema().dump(cls.from_dict(fractional))
+    # the two Address classes would otherwise shadow each other in the body of Order
+    assert 'class Address1:' in result
+
+
+def test_missing_external_types():
+    data = [{'id': 'a', 'created': '2019-01-31T12:00:00Z', 'day': '2019-01-31', 'uid': str(uuid4())}, {'id': 'b'}]
+    rs = analyze.infer(data, {'formats': ('datetime', 'date', 'uuid')})
+    for options in ({}, {'fast_io': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([analyze.to_ir(rs, 'Record')]), options=options)
+        print(result)
+        assert 'created: Optional[datetime] = field(default=None, ' in result
+        module = {}
+        exec(result, module)
+        cls = module['Record']
+        loaded = cls.Schema().load(data[1])
+        assert (loaded.created, loaded.day, loaded.uid) == (None, None, None)
+        assert cls.Schema().load(data[0]).created.year == 2019
+        if options:
+            assert cls.from_dict(data[1]) == loaded
+            assert cls.from_dict(data[0]) == cls.Schema().load(data[0])
+            assert loaded.to_dict() == cls.Schema().dump(loaded)
+
+
+def test_lazy_schema():
+    record = ir.DataClass('Record', [
+        ir.Member('name', [ir.Type('str')]),
+        ir.Member('owner', [ir.DataClass('Owner', [ir.Member('name', [ir.Type('str')])])]),
+    ])
+    data = {'name': 'a', 'owner': {'name': 'b'}}
+    for options in ({'lazy_schema': True}, {'lazy_schema': True, 'slots': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([record]), options=options)
+        print(result)
+        module = {}
+        exec(result, module)
+        cls = module['Record']
+        assert type(cls.__dict__['Schema']).__name__ == 'LazySchema'
+        assert type(cls.Owner.__dict__['Schema']).__name__ == 'LazySchema'
+        # a subclass gets the schema of the class it inherits it from, like it would without `lazy_schema`
+        sub = type('SubOwner', (cls.Owner,), {})
+        assert sub.Schema is cls.Owner.__dict__['Schema'] is cls.Owner.Schema
+        # the first threads to get at the schema all get the same one
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            schemas = set(pool.map(lambda _: cls.Schema, range(32)))
+        assert schemas == {cls.__dict__['Schema']}
+        assert cls.Schema().dump(cls.Schema().load(data)) == data
+        assert cls.Owner.Schema().load({'name': 'c'}) == cls.Owner('c')
+
+
+def test_batch_io():
+    record = ir.DataClass('Record', [
+        ir.Member('name', [ir.Type('str')]),
+        ir.Member('owner', [ir.DataClass('Owner', [ir.Member('name', [ir.Type('str')])])]),
+    ])
+    data = [{'name': str(i), 'owner': {'name': f'owner {i}'}} for i in range(100)]
+    for options in ({'batch_io': True}, {'batch_io': True, 'fast_io': True, 'slots': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([record]), options=options)
+        print(result)
+        module = {}
+        exec(result, module)
+        cls = module['Record']
+        expected = [cls.Schema().load(r) for r in data]
+        # any iterable will do
+        assert cls.load_many(iter(data)) == expected
+        assert cls.dump_many(expected) == data
+        assert list(cls.iter_dump(cls.iter_load(data))) == data
+        # the generator versions only load what's asked for
+        records = iter(data)
+        loaded = cls.iter_load(records)
+        assert next(loaded) == expected[0]
+        assert next(records) == data[1]
+        # every thread loads with the same schema
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert list(pool.map(lambda i: cls.load_many(data[i:i + 10]), range(0, 100, 10))) == \
+                [expected[i:i + 10] for i in range(0, 100, 10)]
+        if options.get('fast_io'):
+            assert cls._loader() == cls.from_dict
+            assert not hasattr(expected[0], '__dict__')
+        else:
+            assert cls._shared_schema() is cls._shared_schema()
+            assert cls.Owner._shared_schema() is not cls._shared_schema()
+
+
+def test_lazy_nested():
+    owner = ir.DataClass('Owner', [ir.Member('name', [ir.Type('str')])])
+    record = ir.DataClass('Record', [
+        ir.Member('name', [ir.Type('str')]),
+        ir.Member('owner', [owner]),
+        ir.Member('admins', [ir.Sequence('list', [owner])], optional=True),
+        ir.Member('manager', [owner, ir.Type('None')]),
+        ir.Member('labels', [ir.HashTable(key=ir.Type('str'), values=[ir.Type('str')])]),
+        ir.Member('tags', [ir.Sequence('list', [ir.Type('str')])]),
+    ])
+    data = {'name': 'a', 'owner': {'name': 'b'}, 'admins': [{'name': 'c'}], 'manager': {'name': 'd'},
+            'labels': {'x': 'y'}, 'tags': ['z']}
+    for options in ({}, {'hoist': True}, {'slots': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([record]), options=dict(options, lazy_nested=True))
+        print(result)
+        module = {}
+        exec(result, module)
+        cls = module['Record']
+        loaded = cls.from_dict(data)
+        if not options.get('slots'):
+            # nothing nested has been loaded yet
+            assert sorted(vars(loaded)) == ['_raw', 'name', 'tags']
+        assert loaded.manager.name == 'd'
+        if not options.get('slots'):
+            assert sorted(vars(loaded)) == ['_raw', 'manager', 'name', 'tags']
+        assert loaded.manager is loaded.manager
+        assert loaded == cls.Schema().load(data)
+        assert loaded.to_dict() == data
+        # missing members get their defaults, like they do when they're loaded eagerly
+        empty = cls.from_dict({})
+        assert (empty.owner, empty.admins, empty.manager, empty.labels) == (type(empty.owner)(), [], None, {})
+        assert cls().manager is None
+        with pytest.raises(AttributeError):
+            loaded.nothing
+
+
+def test_literals():
+    order = ir.DataClass('Order', [
+        ir.Member('status', [ir.Literal('str', values=['closed', 'open'])]),
+        ir.Member('region', [ir.Literal('str', values=['eu', 'us']), ir.Type('None')], optional=True),
+        ir.Member('note', [ir.Type('str')], optional=True),
+    ])
+    records = [{'status': ''.join(['op', 'en']), 'region': ''.join(['e', 'u'])} for _ in range(2)]
+    for options in ({}, {'fast_io': True}):
+        result = pd.generate_dataclass_definitions(ResultSet([order]), options=options)
+        print(result)
+        assert "    status: Literal['closed','open'] = 'closed'\n" in result
+        assert "    region: Optional[Literal['eu','us']] = field(default=None, " in result
+        module = {}
+        exec(result, module)
+        cls = module['Order']
+        assert cls.Schema().load(records[0]) == cls(status='open', region='eu')
+        assert cls.Schema().load({}) == cls() == cls(status='closed')
+        # modules can still be imported on python < 3.8, where `Literal` comes from `typing_extensions`
+        fallback = {}
+        exec(result.replace('from typing import Literal', 'from typing import NoSuchName'), fallback)
+        assert fallback['Order'].Schema().load({'status': 'open'}).status == 'open'
+        with pytest.raises(Exception, match='Must be one of'):
+            cls.Schema().load({'status': 'lost'})
+
+    # loaded strings are interned, so every instance shares the same copies
+    assert 'from sys import intern\n' in result
+    first, second = cls.from_dict(records[0]), cls.from_dict(records[1])
+    assert first.status is second.status and first.region is second.region
+    assert first.to_dict() == {'status': 'open', 'region': 'eu', 'note': ''}
+    assert cls.from_dict({}) == cls()
+
+
+def test_package(tmp_path, monkeypatch):
+    def address():
+        return ir.DataClass('Address', [ir.Member('street', [ir.Type('str')])])
+
+    customer = ir.DataClass('Customer', [ir.Member('name', [ir.Type('str')]), ir.Member('address', [address()])])
+    order = ir.DataClass('Order', [ir.Member('id', [ir.Type('int')]), ir.Member('customer', [customer]),
+                                   ir.Member('shipping', [address()])])
+    item = ir.DataClass('Import', [ir.Member('sku', [ir.Type('str')])])
+    modules = pd.generate_dataclass_package(ResultSet([order, item]), options={'fast_io': True})
+    assert list(modules) == ['__init__', 'address', 'customer', 'order', 'import_']
+    assert 'from .address import Address\n' in modules['customer']
+    assert 'class Customer:' not in modules['order']
+
+    pd.write_dataclass_package(ResultSet([order, item]), str(tmp_path / 'generated_orders'), {'fast_io': True})
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        import generated_orders
+        assert not [m for m in sys.modules if m.startswith('generated_orders.')]
+        from generated_orders import Customer
+        # importing a class only imports the modules it needs
+        assert sorted(m for m in sys.modules if m.startswith('generated_orders.')) == \
+            ['generated_orders.address', 'generated_orders.customer']
+        assert generated_orders.Customer is Customer
+        data = {'id': 1, 'customer': {'name': 'a', 'address': {'street': 'b'}}, 'shipping': {'street': 'c'}}
+        loaded = generated_orders.Order.from_dict(data)
+        assert loaded == generated_orders.Order.Schema().load(data)
+        assert type(loaded.shipping) is type(loaded.customer.address)
+        assert generated_orders.Import.from_dict({'sku': 'x'}).sku == 'x'
+        assert 'Order' in dir(generated_orders)
+        with pytest.raises(AttributeError):
+            generated_orders.Invoice
+    finally:
+        for name in [m for m in sys.modules if m.split('.')[0] == 'generated_orders']:
+            del sys.modules[name]
+
+
+def test_reserved_class_names():
+    keys = ['type', 'list', 'dict', 'any', 'optional', 'schema', 'class_var']
+    records = [{k: {'name': f'{k} {i}'} for k in keys} for i in range(3)]
+    rs = ResultSet([analyze.to_ir(analyze.infer(records), 'Record')])
+    for options in ({}, {'hoist': True}, {'fast_io': True}, {'hoist': True, 'fast_io': True}):
+        result = pd.generate_dataclass_definitions(rs, options=options)
+        print(result)
+        assert '    type: Type_ = field(default_factory=Type_)\n' in result
+        assert 'class Schema_:' in result and 'class Schema:' not in result
+        module = {}
+        exec(result, module)
+        cls = module['Record']
+        loaded = cls.Schema().load(records[0])
+        assert loaded.type.name == 'type 0' and loaded.schema.name == 'schema 0'
+        assert cls.Schema().dump(loaded) == records[0]
+        if options.get('fast_io'):
+            assert cls.from_dict(records[0]) == loaded
@@ -0,0 +1,85 @@
+from auto_class import intermediate_representation as ir
+from auto_class.backends import generate, py_namedtuple
+from auto_class.intermediate_representation import ResultSet
+from types import MappingProxyType
+from uuid import uuid4
+
+import pytest
+
+
+def test_generate_namedtuple_definitions(order_ir):
+    result = py_namedtuple.generate_namedtuple_definitions(ResultSet([order_ir]))
+    print(result)
+    assert result.startswith('\nfrom typing import Mapping, NamedTuple, Optional, Tuple, Union\n')
+    assert 'from types import MappingProxyType\n' in result
+    # every record is defined once, at the top level, before the records which use it
+    assert result.count('class Address(NamedTuple):') == 1
+    assert result.index('class Address(') < result.index('class Items(') < result.index('class Order(')
+    assert "    items: Tuple[Items, ...] = ()\n" in result
+    assert "    totals: Mapping[str,Union[int,float]] = MappingProxyType({})\n" in result
+    # there's no safe default for a datetime, so it becomes optional
+    assert "    created_at: Optional[datetime] = None\n" in result
+
+    module = {}
+    exec(result, module)
+    cls = module['Order']
+    data = {'id': '12', 'created-at': '2020-01-02T03:04:05+00:00', 'note': None, 'status': 'shipped',
+            'shipping': {'street': 'a', 'Postal Code': 'H0H 0H0'}, 'billing': {'street': 'b'},
+            'items': [{'sku': str(uuid4()), 'quantity': 3, 'tags': ['x']}, {'sku': str(uuid4())}],
+            'totals': {'subtotal': 1.5}, 'history': {'x': ['2020-01-01']}, 'ref': str(uuid4())}
+    loaded = cls.from_dict(data)
+    assert isinstance(loaded, tuple)
+    assert loaded.id == 12
+    assert loaded.items[1].quantity == 1 and loaded.items[0].tags == ('x',)
+    assert type(loaded.shipping) is type(loaded.billing) is module['Address']
+    with pytest.raises(AttributeError):
+        loaded.id = 13
+    # hash tables are read-only, and don't change with the data they were loaded from
+    assert isinstance(loaded.totals, MappingProxyType) and isinstance(loaded.history, MappingProxyType)
+    with pytest.raises(TypeError):
+        loaded.totals['subtotal'] = 2.0
+    data['totals']['subtotal'] = 3.0
+    assert loaded.totals['subtotal'] == 1.5
+    data['totals']['subtotal'] = 1.5
+
+    dumped = loaded.to_dict()
+    data['id'] = 12
+    data['billing']['Postal Code'] = None
+    data['items'][1].update(quantity=1, tags=[])
+    assert dumped == data
+
+    empty = cls.from_dict({})
+    assert empty == cls()
+    assert empty.to_dict() == {'id': 0, 'created-at': None, 'note': None, 'status': 'new',
+                               'shipping': {'street': '', 'Postal Code': None}, 'billing': None, 'items': [],
+                               'totals': {}, 'history': {}, 'ref': ''}
+
+
+def test_generate_with_backend(order_ir):
+    rs = ResultSet([order_ir])
+    assert generate(rs, 'py_namedtuple') == py_namedtuple.generate_namedtuple_definitions(rs)
+    assert '@dataclass' in generate(rs)
+    with pytest.raises(Exception, match='Unknown backend'):
+        generate(rs, 'cobol')
+
+
+def test_literal_defaults():
+    record = ir.DataClass('Order', [ir.Member('status', [ir.Literal('str', values=['closed', 'open'])])])
+    result = py_namedtuple.generate_namedtuple_definitions(ResultSet([record]))
+    # an empty string isn't one of the values
+    assert "    status: Literal['closed','open'] = 'closed'\n" in result
+    module = {}
+    exec(result, module)
+    assert module['Order'].from_dict({}).status == 'closed'
+    assert module['Order'].from_dict({'status': 'open'}).status == 'open'
+
+
+def test_hashtables_in_unions():
+    record = ir.DataClass('Record', [ir.Member('meta', [ir.HashTable(key=ir.Type('str'), values=[ir.Type('date')]),
+                                                        ir.Type('str')])])
+    module = {}
+    exec(py_namedtuple.generate_namedtuple_definitions(ResultSet([record])), module)
+    cls = module['Record']
+    for data in ({'meta': {'a': '2020-01-01'}}, {'meta': 'none'}):
+        assert cls.from_dict(data).to_dict() == data
+    assert isinstance(cls.from_dict({'meta': {'a': '2020-01-01'}}).meta, MappingProxyType)
@@ -0,0 +1,49 @@
+import sys
+
+from auto_class import reference_generate as rg
+
+import pytest
+
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(rg, 'GENERATED_CLASSES', {})
+    monkeypatch.setattr(rg, 'CUSTOM_FIELDS', {})
+    monkeypatch.setattr(rg, 'REQUIRED_TYPES', set())
+    monkeypatch.setattr(rg, 'CLASS_NAMES', rg.NameAllocator())
+
+
+def test_get_class_name(fresh_state):
+    assert rg.get_class_name('Item', ['a']) == ('Item', False)
+    assert rg.get_class_name('Item', ['a']) == ('Item', True)
+    assert rg.get_class_name('Item', ['b']) == ('Item1', False)
+    assert rg.get_class_name('Item', ['b', 'b']) == ('Item1', True)
+    assert rg.get_class_name('Item', ['c']) == ('Item2', False)
+    assert rg.get_class_name('Item1', ['d']) == ('Item3', False)
+    assert rg.get_class_name('Item7', ['e']) == ('Item7', False)
+    assert rg.get_class_name('Item7', ['f']) == ('Item8', False)
+    assert rg.get_class_name('Other', ['a']) == ('Other', False)
+    assert rg.get_class_name('Item2', ['c']) == ('Item2', True)
+
+
+def test_numbered_names_are_not_merged(fresh_state):
+    assert rg.get_class_name('Ipv4', ['addr']) == ('Ipv4', False)
+    assert rg.get_class_name('Ipv6', ['addr']) == ('Ipv6', False)
+    assert rg.get_class_name('Ipv6', ['addr']) == ('Ipv6', True)
+
+
+def test_colliding_class_names(fresh_state):
+    # every one of these classes wants the same name, which used to take a recursive call per name already taken
+    n = 10000
+    assert n > sys.getrecursionlimit()
+    names = [rg.get_class_name('Item', [f'field{i}'])[0] for i in range(n)]
+    assert names == ['Item'] + [f'Item{i}' for i in range(1, n)]
+    # the counter picks up where it left off, instead of trying every name that's already taken
+    assert rg.CLASS_NAMES.counters == {'Item': n - 1}
+    assert [rg.get_class_name('Item', [f'field{i}']) for i in (0, n - 1)] == [('Item', True), (f'Item{n - 1}', True)]
+
+
+def test_from_dict_names_colliding_classes(fresh_state):
+    code = rg.from_dict({'a': {'item': {'x': 1}}, 'b': {'item': {'y': 1}}, 'c': {'item': {'x': 2}}}, 'root', '')
+    assert 'class Item:' in code and 'class Item1:' in code and 'class Item2:' not in code
+    assert '    item: Item1 \n' in code